@@ -1,6 +1,5 @@
-import os
-from dotenv import load_dotenv
-from google import genai
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from core.bootstrap import get_client
 
 def cleanup_stores():
     """
@@ -8,15 +7,13 @@ def cleanup_stores():
     and allows the user to select which store(s) to delete.
     """
     try:
-        load_dotenv()
-        google_api_key = os.getenv("GOOGLE_API_KEY")
-        if not google_api_key:
+        print("--- Initializing Google AI Client ---")
+        try:
+            client = get_client()
+        except ValueError:
             print("❌ Error: GOOGLE_API_KEY not found in .env file.")
             return
 
-        print("--- Initializing Google AI Client ---")
-        client = genai.Client(api_key=google_api_key)
-
         stores = list(client.file_search_stores.list())
         if not stores:
             print("✅ No file search stores found to delete.")
@@ -41,13 +38,19 @@ def cleanup_stores():
                 confirm = input("\nAre you sure you want to delete ALL of these stores? This is permanent. (yes/no): ").lower().strip()
                 if confirm == 'yes':
                     print("\n--- Starting Deletion Process (ALL) ---")
-                    for store in stores:
-                        try:
-                            print(f"Deleting store: {store.display_name} ({store.name})...")
-                            client.file_search_stores.delete(name=store.name, config={'force': True})
-                            print(f"✅ Deleted successfully.")
-                        except Exception as e:
-                            print(f"❌ Failed to delete {store.display_name}: {e}")
+                    # Each delete is an independent round-trip, so issue them concurrently
+                    with ThreadPoolExecutor(max_workers=8) as executor:
+                        futures = {
+                            executor.submit(client.file_search_stores.delete, name=store.name, config={'force': True}): store
+                            for store in stores
+                        }
+                        for future in as_completed(futures):
+                            store = futures[future]
+                            try:
+                                future.result()
+                                print(f"✅ Deleted store: {store.display_name} ({store.name})")
+                            except Exception as e:
+                                print(f"❌ Failed to delete {store.display_name}: {e}")
                     print("\n--- All Stores Deleted ---")
                     break 
                 else:
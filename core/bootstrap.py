@@ -0,0 +1,64 @@
+import os
+from functools import lru_cache
+import yaml
+from dotenv import load_dotenv
+
+# Prefer the LibYAML-backed loader when PyYAML was built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+def get_api_key():
+    """Loads .env and returns the Google API key, raising ValueError if it is missing."""
+    load_dotenv()
+    google_api_key = os.getenv("GOOGLE_API_KEY")
+    if not google_api_key:
+        raise ValueError("GOOGLE_API_KEY not found in .env file")
+    return google_api_key
+
+@lru_cache(maxsize=1)
+def load_config():
+    """Loads configuration from .env, prompts.yaml and config.yaml."""
+    google_api_key = get_api_key()
+
+    with open("prompts.yaml", "r") as f:
+        prompts = yaml.load(f, Loader=YAML_LOADER)
+
+    with open("config.yaml", "r") as f:
+        config = yaml.load(f, Loader=YAML_LOADER)
+
+    return google_api_key, prompts, config
+
+def _load_http_pool_config():
+    """
+    Returns the http_pool section of config.yaml, or {} if the file is missing,
+    so the client can be created without the app's other config files.
+    """
+    try:
+        with open("config.yaml", "r") as f:
+            config = yaml.load(f, Loader=YAML_LOADER) or {}
+    except FileNotFoundError:
+        return {}
+    return config.get("http_pool") or {}
+
+@lru_cache(maxsize=1)
+def get_client():
+    """
+    Returns the process-wide Gemini client, so every caller shares one
+    HTTP connection pool.
+    """
+    # Deferred so a missing key or config file aborts before paying the import cost
+    import httpx
+    from google import genai
+    from google.genai import types
+
+    # Size the pool for concurrent uploads, and keep idle connections alive across the
+    # ingest polling loop's backoff so requests don't pay a fresh TLS handshake
+    pool_config = _load_http_pool_config()
+    limits = httpx.Limits(
+        max_connections=pool_config.get("max_connections", 32),
+        max_keepalive_connections=pool_config.get("max_connections", 32),
+        keepalive_expiry=pool_config.get("keepalive_expiry", 30)
+    )
+    return genai.Client(
+        api_key=get_api_key(),
+        http_options=types.HttpOptions(client_args={"limits": limits})
+    )
@@ -4,35 +4,51 @@ from datetime import datetime
 import tempfile
 import json
 import os
+import re
+import hashlib
+import secrets
+import threading
+import queue
+import random
+import atexit
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.request import pathname2url
+import numpy as np
 from google.genai import types, errors
 
-# --- SQLite Datetime Adapters ---
-def adapt_datetime_iso(val):
-    return val.isoformat()
+try:
+    import sqlite_vec
+except ImportError:
+    sqlite_vec = None
 
-def convert_datetime(val):
-    return datetime.fromisoformat(val.decode())
-
-sqlite3.register_adapter(datetime, adapt_datetime_iso)
-sqlite3.register_converter("DATETIME", convert_datetime)
-
-from core.tools import get_tool_definitions, list_files, read_file, search_knowledge_graph, set_workspace_path, get_graph_path
+from core.tools import get_tool_definitions, list_files, read_file, search_knowledge_graph, set_workspace_path, get_graph_path, json_dumps, json_loads
 from core.store_utils import get_or_create_store
 
-def send_message_with_retry(chat_session, content, max_retries=3):
-    """Sends a message to the chat session with retry logic for rate limits."""
+_RETRY_MAX_WAIT = 60  # seconds
+
+def stream_message_with_retry(chat_session, content, max_retries=3):
+    """
+    Streams a message to the chat session, yielding response chunks.
+    Rate-limited requests are retried as long as no chunk has been received yet.
+    """
     for attempt in range(max_retries):
+        received = False
         try:
-            return chat_session.send_message(content)
+            for chunk in chat_session.send_message_stream(content):
+                received = True
+                yield chunk
+            return
         except errors.ClientError as e:
-            if "429" in str(e) or "RESOURCE_EXHAUSTED" in str(e):
+            if not received and ("429" in str(e) or "RESOURCE_EXHAUSTED" in str(e)):
                 if attempt < max_retries - 1:
-                    wait_time = (attempt + 1) * 10  # Exponential-ish backoff: 10s, 20s, 30s
-                    print(f"Rate limit hit (429). Retrying in {wait_time} seconds...")
+                    # Exponential backoff with jitter, so concurrent sessions don't retry in lockstep
+                    wait_time = min(_RETRY_MAX_WAIT, 2 ** attempt + random.random() * 2)
+                    print(f"Rate limit hit (429). Retrying in {wait_time:.1f} seconds...")
                     time.sleep(wait_time)
                     continue
             raise e
-    return None # Should raise before this
 
 available_tools = {
     "list_files": list_files,
@@ -41,110 +57,693 @@ available_tools = {
     "set_workspace_path": set_workspace_path
 }
 
+# --- Chat Session Cache ---
+# Live Gemini chat sessions keyed by conversation_id, so resuming a conversation
+# reuses the existing session instead of replaying the whole transcript.
+_SESSION_CACHE_SIZE = 64
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def get_cached_session(conversation_id):
+    """Returns the cached chat session for a conversation, or None."""
+    with _sessions_lock:
+        chat_session = _sessions.get(conversation_id)
+        if chat_session is not None:
+            _sessions.move_to_end(conversation_id)
+        return chat_session
+
+def cache_session(conversation_id, chat_session):
+    """Caches a chat session, evicting the least recently used one when full."""
+    with _sessions_lock:
+        _sessions[conversation_id] = chat_session
+        _sessions.move_to_end(conversation_id)
+        while len(_sessions) > _SESSION_CACHE_SIZE:
+            _sessions.popitem(last=False)
+
+def evict_session(conversation_id):
+    """Drops the cached chat session for a conversation, if any."""
+    with _sessions_lock:
+        _sessions.pop(conversation_id, None)
+
+# --- Database Connection ---
+# A single long-lived read-write connection per database, shared across Gradio worker
+# threads, plus a small pool of read-only connections so reads don't queue behind writes.
+_connections = {}
+_db_lock = threading.RLock()
+_READER_POOL_SIZE = max(1, int(os.getenv("AURORA_SQLITE_READERS", "4")))
+_reader_pools = {}  # db_name -> (LifoQueue of idle readers, [number opened])
+_reader_pools_lock = threading.Lock()  # separate from _db_lock, which the writer holds during transactions
+
+# Chat history is append-only and non-critical, so trade per-commit durability
+# for throughput: WAL with group commit instead of two fsyncs per insert.
+# Automatic checkpoints are off; the background writer checkpoints instead (see _checkpoint_wal).
+_WRITER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA wal_autocheckpoint=0",
+)
+_READER_PRAGMAS = (
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+    # Wait for another process's lock (e.g. a second app instance) instead of failing immediately
+    "PRAGMA busy_timeout=5000",
+    # Memory-map reads; set AURORA_SQLITE_MMAP_SIZE=0 to disable (e.g. on 32-bit hosts)
+    f"PRAGMA mmap_size={int(os.getenv('AURORA_SQLITE_MMAP_SIZE', '268435456'))}",
+)
+_CONNECTION_PRAGMAS = _WRITER_PRAGMAS + _READER_PRAGMAS
+
+# The semantic cache uses a sqlite-vec index when the extension can be loaded,
+# and falls back to a brute-force scan otherwise (or when AURORA_USE_VEC_INDEX=0).
+_USE_VEC_INDEX = os.getenv("AURORA_USE_VEC_INDEX", "1") != "0"
+_VEC_DIMENSIONS = 768  # text-embedding-004
+# Nearest neighbours fetched per lookup; vec0 applies k before the TTL filter, so
+# expired entries nearer the query must not crowd out a live match
+_VEC_CANDIDATES = 16
+_vec_enabled = set()  # databases whose connection has sqlite-vec loaded
+
+def _load_vec_extension(conn, db_name):
+    """Loads sqlite-vec into the connection if it is enabled and available."""
+    if not _USE_VEC_INDEX or sqlite_vec is None:
+        return
+    try:
+        conn.enable_load_extension(True)
+        sqlite_vec.load(conn)
+        conn.enable_load_extension(False)
+        _vec_enabled.add(db_name)
+    except (AttributeError, sqlite3.Error) as e:
+        print(f"sqlite-vec unavailable, semantic cache will use a brute-force scan: {e}")
+
+def get_conn(db_name):
+    """Returns the shared autocommit connection for db_name, opening and tuning it on first use."""
+    with _db_lock:
+        conn = _connections.get(db_name)
+        if conn is None:
+            conn = sqlite3.connect(
+                db_name,
+                check_same_thread=False,
+                isolation_level=None
+            )
+            for pragma in _CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            _load_vec_extension(conn, db_name)
+            _connections[db_name] = conn
+        return conn
+
+@contextmanager
+def db_connection(db_name):
+    """Yields the shared connection while holding the database lock."""
+    conn = get_conn(db_name)
+    with _db_lock:
+        yield conn
+
+def _open_reader(db_name):
+    """Opens a read-only connection to db_name, or returns None if it can't be opened."""
+    get_conn(db_name)  # the writer creates the file, enables WAL and decides on sqlite-vec
+    uri = "file:" + pathname2url(os.path.abspath(db_name)) + "?mode=ro"
+    try:
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+        for pragma in _READER_PRAGMAS:
+            conn.execute(pragma)
+        if db_name in _vec_enabled:
+            conn.enable_load_extension(True)
+            sqlite_vec.load(conn)
+            conn.enable_load_extension(False)
+        return conn
+    except (AttributeError, sqlite3.Error) as e:
+        print(f"Could not open a read-only connection to {db_name}, reading through the shared connection: {e}")
+        return None
+
+@contextmanager
+def db_reader(db_name):
+    """
+    Yields a pooled read-only connection without taking the database lock, so reads run
+    concurrently with the writer under WAL. Falls back to the shared connection if needed.
+    """
+    conn = None
+    if db_name != ":memory:":
+        open_new = False
+        with _reader_pools_lock:
+            if db_name not in _reader_pools:
+                _reader_pools[db_name] = (queue.LifoQueue(), [0])
+            pool = _reader_pools[db_name]  # None once opening a reader has failed
+            if pool is not None:
+                idle, opened = pool
+                try:
+                    conn = idle.get_nowait()
+                except queue.Empty:
+                    # Reserve a slot for a new reader, or wait below for a busy one to be returned
+                    open_new = opened[0] < _READER_POOL_SIZE
+                    if open_new:
+                        opened[0] += 1
+        if open_new:
+            conn = _open_reader(db_name)
+            if conn is None:
+                with _reader_pools_lock:
+                    opened[0] -= 1
+                    _reader_pools[db_name] = None
+        elif pool is not None and conn is None:
+            conn = idle.get()
+    if conn is None:
+        with db_connection(db_name) as conn:
+            yield conn
+        return
+    try:
+        yield conn
+    finally:
+        idle.put(conn)
+
+@contextmanager
+def db_transaction(db_name):
+    """
+    Yields the shared connection inside a single BEGIN IMMEDIATE ... COMMIT,
+    rolling back if the block raises.
+    """
+    with db_connection(db_name) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+def _checkpoint_wal():
+    """Checkpoints every open database and truncates its WAL file."""
+    with _db_lock:
+        for db_name, conn in list(_connections.items()):
+            try:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                print(f"Error checkpointing database {db_name}: {e}")
+
+def close_connections():
+    """Closes idle readers, then runs PRAGMA optimize on each shared connection and closes it."""
+    # Readers first, so the writer is the last connection and can clean up the WAL
+    with _reader_pools_lock:
+        for pool in _reader_pools.values():
+            if pool is None:
+                continue
+            idle = pool[0]
+            while not idle.empty():
+                idle.get_nowait().close()
+        _reader_pools.clear()
+    with _db_lock:
+        for db_name, conn in list(_connections.items()):
+            try:
+                conn.execute("PRAGMA optimize")
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Error closing database {db_name}: {e}")
+        _connections.clear()
+        _vec_enabled.clear()
+
+# Registered before the history writer's flush hook, so it runs after it at exit
+atexit.register(close_connections)
+
 # --- Database Management ---
+_SCHEMA_VERSION = 2  # stored in PRAGMA user_version; bump when adding a migration
+_EMBEDDING_CACHE_DDL = """
+    CREATE TABLE IF NOT EXISTS embedding_cache (
+        text_hash TEXT PRIMARY KEY,
+        embedding BLOB NOT NULL,
+        last_used INTEGER NOT NULL DEFAULT 0
+    )
+"""
 def init_db(db_name):
     """Initializes the SQLite database and creates the history table if it doesn't exist."""
     print(f"--- Initializing Database: {db_name} ---")
     try:
-        with sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
+        with db_connection(db_name) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS chat_history (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     conversation_id TEXT NOT NULL,
-                    timestamp DATETIME NOT NULL,
+                    timestamp INTEGER NOT NULL,
                     query TEXT NOT NULL,
                     response TEXT NOT NULL,
                     repo_path TEXT,
                     tool_calls TEXT
                 )
             """)
-            # Migration check
-            cursor.execute("PRAGMA table_info(chat_history)")
-            columns = [info[1] for info in cursor.fetchall()]
-            if "repo_path" not in columns:
-                print("Migrating database: adding 'repo_path' column.")
-                cursor.execute("ALTER TABLE chat_history ADD COLUMN repo_path TEXT")
-
-            if "tool_calls" not in columns:
-                print("Migrating database: adding 'tool_calls' column.")
-                cursor.execute("ALTER TABLE chat_history ADD COLUMN tool_calls TEXT")
-
-            conn.commit()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS semantic_cache (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_id TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at INTEGER NOT NULL
+                )
+            """)
+            cursor.execute(_EMBEDDING_CACHE_DDL)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_convo_ts ON chat_history(conversation_id, timestamp)")
+            # Migrations only run when the stored schema version is behind
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version < _SCHEMA_VERSION:
+                with db_transaction(db_name):
+                    _migrate_schema(cursor, version)
+                    cursor.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+            # Created after the migrations, since older databases lack repo_path until then
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_repo_convo ON chat_history(repo_path, conversation_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_embedding_last_used ON embedding_cache(last_used)")
+
+            if db_name in _vec_enabled:
+                _init_vec_index(cursor)
+
+        _start_writer()
         print("Database initialized successfully.")
     except sqlite3.Error as e:
         print(f"Error initializing database: {e}")
 
-def add_chat_history(db_name, conversation_id, query, response, repo_path=None, tool_calls=None):
-    """Adds a new chat interaction to the history database."""
+def _migrate_schema(cursor, version):
+    """Brings a database from the given user_version up to _SCHEMA_VERSION."""
+    if version < 1:
+        _migrate_unversioned(cursor)
+    if version < 2:
+        # Version 2 stores float16 embeddings with a last_used column for eviction; the old
+        # float32 entries can't be told apart by size, so the cache is simply rebuilt
+        cursor.execute("DROP TABLE IF EXISTS embedding_cache")
+        cursor.execute(_EMBEDDING_CACHE_DDL)
+
+def _migrate_unversioned(cursor):
+    """Brings a database from before schema versioning (user_version 0) up to version 1."""
+    # Unversioned databases may or may not have these columns, depending on when they were created
+    cursor.execute("PRAGMA table_info(chat_history)")
+    columns = [info[1] for info in cursor.fetchall()]
+    if "repo_path" not in columns:
+        print("Migrating database: adding 'repo_path' column.")
+        cursor.execute("ALTER TABLE chat_history ADD COLUMN repo_path TEXT")
+
+    if "tool_calls" not in columns:
+        print("Migrating database: adding 'tool_calls' column.")
+        cursor.execute("ALTER TABLE chat_history ADD COLUMN tool_calls TEXT")
+
+    # Timestamps used to be stored as local ISO-8601 strings; convert them to unix epoch seconds
+    for table, column in (("chat_history", "timestamp"), ("semantic_cache", "created_at")):
+        cursor.execute(
+            f"UPDATE {table} SET {column} = CAST(strftime('%s', {column}, 'utc') AS INTEGER) WHERE typeof({column}) = 'text'"
+        )
+        if cursor.rowcount > 0:
+            print(f"Migrating database: converted {cursor.rowcount} {table}.{column} values to epoch seconds.")
+
+def _init_vec_index(cursor):
+    """Creates the sqlite-vec index for the semantic cache and backfills any unindexed entries."""
     try:
-        with sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
-            cursor = conn.cursor()
-            tool_calls_json = json.dumps(tool_calls) if tool_calls is not None else None
-            cursor.execute(
-                "INSERT INTO chat_history (conversation_id, timestamp, query, response, repo_path, tool_calls) VALUES (?, ?, ?, ?, ?, ?)",
-                (conversation_id, datetime.now(), query, response, repo_path, tool_calls_json)
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS vec_cache USING vec0(
+                conversation_id TEXT PARTITION KEY,
+                embedding FLOAT[{_VEC_DIMENSIONS}] distance_metric=cosine
             )
-            conn.commit()
+        """)
+        cursor.execute(
+            "SELECT id, conversation_id, embedding FROM semantic_cache WHERE id NOT IN (SELECT rowid FROM vec_cache)"
+        )
+        unindexed = cursor.fetchall()
+        cursor.executemany(
+            "INSERT INTO vec_cache (rowid, conversation_id, embedding) VALUES (?, ?, ?)",
+            [(row_id, conversation_id, _decode_cached_embedding(blob).tobytes()) for row_id, conversation_id, blob in unindexed]
+        )
     except sqlite3.Error as e:
-        print(f"Error adding to chat history: {e}")
+        print(f"Error initializing semantic cache index: {e}")
+
+# --- Background Writer ---
+# Chat turns and semantic cache entries are queued and written in batches by a
+# single writer thread, so the chat path never waits on a commit.
+# Readers call flush_chat_history() first.
+_WRITE_BATCH_SIZE = 64
+_WRITE_FLUSH_INTERVAL = 0.05  # seconds to wait for more rows before writing a batch
+_CHECKPOINT_INTERVAL = 30.0  # seconds between WAL checkpoints run by the writer
+_write_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+def _insert_history_rows(db_name, conn, rows):
+    conn.executemany(
+        "INSERT INTO chat_history (conversation_id, timestamp, query, response, repo_path, tool_calls) VALUES (?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+def _commit_rows(db_name, insert_rows, rows):
+    with db_transaction(db_name) as conn:
+        insert_rows(db_name, conn, rows)
+
+def _write_rows(db_name, grouped_rows):
+    """
+    Writes the queued rows for db_name on its shared connection; grouped_rows maps each
+    insert_rows function to its rows. Each kind of row commits in its own transaction, so a
+    failing cache insert never costs a chat_history row. If a batch fails, its rows are retried
+    one at a time, so only the bad row is dropped. Any error is caught (e.g. a lone surrogate
+    raising UnicodeEncodeError), so a bad row can't kill the writer.
+    """
+    for insert_rows, rows in grouped_rows.items():
+        try:
+            _commit_rows(db_name, insert_rows, rows)
+        except Exception as e:
+            if len(rows) == 1:
+                print(f"Error writing to {db_name} for conversation {rows[0][0]}, dropping the row: {e}")
+                continue
+            print(f"Error writing {len(rows)} rows to {db_name}, retrying one at a time: {e}")
+            for row in rows:
+                try:
+                    _commit_rows(db_name, insert_rows, [row])
+                except Exception as e:
+                    print(f"Error writing to {db_name} for conversation {row[0]}, dropping the row: {e}")
+
+def _writer_loop():
+    """
+    Drains the write queue, grouping up to _WRITE_BATCH_SIZE rows per batch,
+    and checkpoints the WAL every _CHECKPOINT_INTERVAL seconds so no commit pays for it.
+    """
+    last_checkpoint = time.monotonic()
+    while True:
+        try:
+            batch = [_write_queue.get(timeout=_CHECKPOINT_INTERVAL)]
+        except queue.Empty:
+            batch = []
+        while batch and len(batch) < _WRITE_BATCH_SIZE:
+            try:
+                batch.append(_write_queue.get(timeout=_WRITE_FLUSH_INTERVAL))
+            except queue.Empty:
+                break
+
+        # Rows are grouped by database and kind; each group is one commit.
+        try:
+            grouped = {}
+            for db_name, insert_rows, row in batch:
+                grouped.setdefault(db_name, {}).setdefault(insert_rows, []).append(row)
+            for db_name, grouped_rows in grouped.items():
+                _write_rows(db_name, grouped_rows)
+        finally:
+            # Always release the batch, or flush_chat_history() would block forever
+            for _ in batch:
+                _write_queue.task_done()
+
+        if time.monotonic() - last_checkpoint >= _CHECKPOINT_INTERVAL:
+            _checkpoint_wal()
+            last_checkpoint = time.monotonic()
+
+def _start_writer():
+    """Starts the background writer thread if it isn't running yet."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_loop, name="chat-db-writer", daemon=True)
+            _writer.start()
+
+def _enqueue_write(db_name, insert_rows, row):
+    """
+    Queues a row for the background writer; insert_rows(db_name, conn, rows) writes a batch.
+    Rows start with their conversation_id, which is logged if the row can't be written.
+    """
+    _start_writer()
+    _write_queue.put((db_name, insert_rows, row))
+
+def flush_chat_history():
+    """Blocks until every queued write has been committed."""
+    _write_queue.join()
+
+atexit.register(flush_chat_history)
+
+def add_chat_history(db_name, conversation_id, query, response, repo_path=None, tool_calls=None):
+    """Queues a new chat interaction to be written to the history database."""
+    tool_calls_json = json_dumps(tool_calls) if tool_calls is not None else None
+    _enqueue_write(db_name, _insert_history_rows, (conversation_id, int(time.time()), query, response, repo_path, tool_calls_json))
+    invalidate_conversations(db_name)
+
+# --- Conversation List Cache ---
+# (db_name, repo_path) -> (fetched_at, conversations). Entries are dropped whenever chat
+# history changes in this process; the TTL bounds staleness from other processes.
+_CONVERSATIONS_TTL = 60  # seconds
+_conversations_cache = {}
+_conversations_generation = 0  # bumped on invalidation, so in-flight fetches don't store stale lists
+_conversations_lock = threading.Lock()
+
+def invalidate_conversations(db_name):
+    """Drops the cached conversation lists of every repository in db_name."""
+    global _conversations_generation
+    with _conversations_lock:
+        _conversations_generation += 1
+        for key in [key for key in _conversations_cache if key[0] == db_name]:
+            del _conversations_cache[key]
 
 def get_conversations(db_name, repo_path=None):
-    """Retrieves a list of unique conversation IDs and their first query as the title."""
+    """
+    Retrieves a list of unique conversation IDs and their first query as the title.
+    Titles are truncated to 40 characters in SQL so long pasted queries never leave the database.
+    Results are cached until the history changes or _CONVERSATIONS_TTL expires.
+    """
+    key = (db_name, repo_path or None)
+    with _conversations_lock:
+        cached = _conversations_cache.get(key)
+        if cached and time.monotonic() - cached[0] < _CONVERSATIONS_TTL:
+            return list(cached[1])
+        generation = _conversations_generation
+
+    flush_chat_history()
     try:
-        with sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
-            cursor = conn.cursor()
-            sql = """
-                SELECT T1.conversation_id, T1.query
-                FROM chat_history T1
-                JOIN (
-                    SELECT conversation_id, MIN(timestamp) AS min_ts
-                    FROM chat_history
-                    GROUP BY conversation_id
-                ) T2 ON T1.conversation_id = T2.conversation_id AND T1.timestamp = T2.min_ts
-            """
+        with db_reader(db_name) as conn:
+            # ids are assigned in insertion order, so each conversation's MIN(id) is its
+            # first message. The GROUP BY is answered from idx_convo_ts alone, or from
+            # idx_repo_convo's range for a single repository (conversations never span repos).
+            where = ""
             params = []
             if repo_path:
-                sql += " WHERE T1.repo_path = ?"
+                where = "WHERE repo_path = ?"
                 params.append(repo_path)
-            
-            sql += " ORDER BY T1.timestamp DESC;"
-            cursor.execute(sql, tuple(params))
-            return cursor.fetchall()
+
+            sql = f"""
+                SELECT conversation_id,
+                       substr(query, 1, 40) || CASE WHEN length(query) > 40 THEN '...' ELSE '' END
+                FROM chat_history
+                WHERE id IN (SELECT MIN(id) FROM chat_history {where} GROUP BY conversation_id)
+            """
+            sql += " ORDER BY id DESC;"
+            conversations = conn.execute(sql, tuple(params)).fetchall()
     except sqlite3.Error as e:
         print(f"Error fetching conversations: {e}")
         return []
 
+    with _conversations_lock:
+        if generation == _conversations_generation:
+            _conversations_cache[key] = (time.monotonic(), conversations)
+    return list(conversations)
+
 def delete_conversation_from_db(db_name, conversation_id):
-    """Deletes all messages for a given conversation_id from the database."""
+    """
+    Deletes all messages for a given conversation_id from the database.
+    Returns the number of chat_history rows removed, or None on error.
+    """
+    flush_chat_history()
+    evict_session(conversation_id)
     try:
-        with sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
+        # One transaction so a conversation is never left half-deleted
+        with db_transaction(db_name) as conn:
+            deleted = conn.execute(
                 "DELETE FROM chat_history WHERE conversation_id = ?",
                 (conversation_id,)
+            ).rowcount
+            if db_name in _vec_enabled:
+                conn.execute(
+                    "DELETE FROM vec_cache WHERE rowid IN (SELECT id FROM semantic_cache WHERE conversation_id = ?)",
+                    (conversation_id,)
+                )
+            conn.execute(
+                "DELETE FROM semantic_cache WHERE conversation_id = ?",
+                (conversation_id,)
             )
-            conn.commit()
-        print(f"Deleted conversation: {conversation_id}")
-        return True
+        invalidate_conversations(db_name)
+        print(f"Deleted conversation: {conversation_id} ({deleted} messages)")
+        return deleted
     except sqlite3.Error as e:
         print(f"Error deleting conversation {conversation_id}: {e}")
-        return False
+        return None
 
-def load_conversation_from_db(db_name, conversation_id):
-    """Loads a past conversation from the database."""
+def load_conversation_from_db(db_name, conversation_id, limit=None):
+    """
+    Loads a past conversation from the database.
+    With a limit, only the most recent `limit` interactions are returned, oldest first.
+    """
+    flush_chat_history()
     try:
-        with sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT query, response, tool_calls FROM chat_history WHERE conversation_id = ? ORDER BY timestamp ASC",
-                (conversation_id,)
-            )
+        with db_reader(db_name) as conn:
+            if limit is None:
+                cursor = conn.execute(
+                    "SELECT query, response, tool_calls FROM chat_history WHERE conversation_id = ? ORDER BY timestamp ASC, id ASC",
+                    (conversation_id,)
+                )
+            else:
+                # The inner scan walks idx_convo_ts backwards, so only the tail is read
+                cursor = conn.execute(
+                    """
+                    SELECT query, response, tool_calls FROM (
+                        SELECT id, query, response, tool_calls, timestamp FROM chat_history
+                        WHERE conversation_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?
+                    ) ORDER BY timestamp ASC, id ASC
+                    """,
+                    (conversation_id, limit)
+                )
             return cursor.fetchall()
     except sqlite3.Error as e:
         print(f"Error loading conversation: {e}")
         return []
 
+def load_conversation_messages(db_name, conversation_id):
+    """Loads only the (query, response) pairs of a conversation, skipping the tool_calls JSON."""
+    flush_chat_history()
+    try:
+        with db_reader(db_name) as conn:
+            return conn.execute(
+                "SELECT query, response FROM chat_history WHERE conversation_id = ? ORDER BY timestamp ASC, id ASC",
+                (conversation_id,)
+            ).fetchall()
+    except sqlite3.Error as e:
+        print(f"Error loading conversation: {e}")
+        return []
+
+# --- Semantic Response Cache ---
+# Cached embeddings (semantic_cache and embedding_cache) are stored as float16 to halve
+# their size on disk and in the page cache; the vec0 index keeps its own float32 copy.
+def _encode_cached_embedding(embedding):
+    return embedding.astype(np.float16).tobytes()
+
+def _decode_cached_embedding(blob):
+    return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+
+# Rows kept in embedding_cache; the least recently used are evicted beyond this,
+# checked every _EMBEDDING_EVICT_INTERVAL inserts
+_EMBEDDING_CACHE_MAX_ROWS = 20000
+_EMBEDDING_EVICT_INTERVAL = 256
+_embedding_inserts = 0
+
+def _load_embedding(db_name, text_hash):
+    """Returns a persisted embedding blob for the given text hash, or None."""
+    try:
+        with db_reader(db_name) as conn:
+            row = conn.execute("SELECT embedding FROM embedding_cache WHERE text_hash = ?", (text_hash,)).fetchone()
+            return row[0] if row else None
+    except sqlite3.Error as e:
+        print(f"Error reading embedding cache: {e}")
+        return None
+
+def _touch_embedding(db_name, text_hash):
+    """Marks a persisted embedding as recently used, so eviction keeps it."""
+    try:
+        with db_connection(db_name) as conn:
+            conn.execute("UPDATE embedding_cache SET last_used = ? WHERE text_hash = ?", (int(time.time()), text_hash))
+    except sqlite3.Error as e:
+        print(f"Error updating embedding cache: {e}")
+
+def _store_embedding(db_name, text_hash, embedding):
+    """
+    Persists an embedding so warm restarts skip the embedding API call, evicting the
+    least recently used entries once the table grows past _EMBEDDING_CACHE_MAX_ROWS.
+    """
+    global _embedding_inserts
+    try:
+        with db_connection(db_name) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO embedding_cache (text_hash, embedding, last_used) VALUES (?, ?, ?)",
+                (text_hash, _encode_cached_embedding(embedding), int(time.time()))
+            )
+            _embedding_inserts += 1
+            if _embedding_inserts % _EMBEDDING_EVICT_INTERVAL == 0:
+                conn.execute(
+                    """
+                    DELETE FROM embedding_cache WHERE text_hash IN (
+                        SELECT text_hash FROM embedding_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (_EMBEDDING_CACHE_MAX_ROWS,)
+                )
+    except sqlite3.Error as e:
+        print(f"Error adding to embedding cache: {e}")
+
+@lru_cache(maxsize=2048)
+def _embed(client, db_name, model, text):
+    """
+    Memoized embedding lookup: in-process LRU first, then the SQLite embedding
+    cache, and only then the Gemini embedding API.
+    """
+    text_hash = hashlib.sha256(f"{model}:{text}".encode('utf-8')).hexdigest()
+    blob = _load_embedding(db_name, text_hash)
+    if blob is not None:
+        embedding = _decode_cached_embedding(blob)
+        _touch_embedding(db_name, text_hash)
+    else:
+        result = client.models.embed_content(model=model, contents=text)
+        embedding = np.asarray(result.embeddings[0].values, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        if norm:
+            embedding = embedding / norm
+        _store_embedding(db_name, text_hash, embedding)
+    # Cached arrays are shared between callers, so keep them immutable
+    embedding.setflags(write=False)
+    return embedding
+
+def embed_text(client, db_name, text, model):
+    """Embeds text with the Gemini embedding model and returns a unit-length float32 vector."""
+    return _embed(client, db_name, model, text)
+
+def get_embedding_cache_info():
+    """Returns hit/miss counters for the in-process embedding cache."""
+    return _embed.cache_info()
+
+def get_cached_response(db_name, conversation_id, embedding, max_distance, ttl_seconds):
+    """
+    Returns the cached response whose query embedding is closest to `embedding`
+    (by cosine distance) within the conversation, or None if nothing is close enough.
+    """
+    cutoff = int(time.time()) - ttl_seconds
+    query_blob = embedding.astype(np.float32).tobytes()
+    try:
+        with db_reader(db_name) as conn:
+            if db_name in _vec_enabled:
+                row = conn.execute(
+                    """
+                    SELECT c.response
+                    FROM vec_cache v JOIN semantic_cache c ON c.id = v.rowid
+                    WHERE v.embedding MATCH ? AND k = ? AND v.conversation_id = ?
+                      AND v.distance < ? AND c.created_at >= ?
+                    ORDER BY v.distance
+                    LIMIT 1
+                    """,
+                    (query_blob, _VEC_CANDIDATES, conversation_id, max_distance, cutoff)
+                ).fetchone()
+                return row[0] if row else None
+
+            rows = conn.execute(
+                "SELECT embedding, response FROM semantic_cache WHERE conversation_id = ? AND created_at >= ?",
+                (conversation_id, cutoff)
+            ).fetchall()
+    except sqlite3.Error as e:
+        print(f"Error reading semantic cache: {e}")
+        return None
+
+    # Brute-force fallback when the sqlite-vec index is unavailable
+    if not rows:
+        return None
+    matrix = _decode_cached_embedding(b"".join(blob for blob, _ in rows)).reshape(len(rows), -1)
+    distances = 1.0 - matrix @ embedding
+    best = int(np.argmin(distances))
+    return rows[best][1] if distances[best] < max_distance else None
+
+def _insert_cache_rows(db_name, conn, rows):
+    for conversation_id, embedding, response, created_at in rows:
+        cursor = conn.execute(
+            "INSERT INTO semantic_cache (conversation_id, embedding, response, created_at) VALUES (?, ?, ?, ?)",
+            (conversation_id, _encode_cached_embedding(embedding), response, created_at)
+        )
+        if db_name in _vec_enabled:
+            conn.execute(
+                "INSERT INTO vec_cache (rowid, conversation_id, embedding) VALUES (?, ?, ?)",
+                (cursor.lastrowid, conversation_id, embedding.astype(np.float32).tobytes())
+            )
+
+def add_cached_response(db_name, conversation_id, embedding, response):
+    """Queues a query embedding and its final response for the semantic cache (and its vector index)."""
+    _enqueue_write(db_name, _insert_cache_rows, (conversation_id, embedding, response, int(time.time())))
+
 def generate_report(conversation_id, db_name):
     """Generates a markdown report from a conversation and returns the file path."""
     if not conversation_id:
@@ -154,31 +753,32 @@ def generate_report(conversation_id, db_name):
     if not history:
         return None
 
-    report_content = f"# Impact Analysis Report\n\n"
-    report_content += f"**Conversation ID:** `{conversation_id}`\n"
-    report_content += f"**Generated on:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-    report_content += "---\n\n"
-
-    for i, (query, response, tool_calls_json) in enumerate(history):
-        report_content += f"### Interaction {i+1}\n\n"
-        report_content += f"**User Query:**\n```\n{query or ''}\n```\n\n"
-        
-        # Add tool info if present
-        if tool_calls_json:
-            try:
-                tool_calls = json.loads(tool_calls_json)
-                if tool_calls:
-                    report_content += "**Tools used:** "
-                    tool_names = [f"`{tc.get('name', 'tool')}`" for tc in tool_calls]
-                    report_content += ", ".join(tool_names) + "\n\n"
-            except:
-                pass
+    # Write each section straight to the file instead of growing one string
+    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.md', encoding='utf-8') as temp_file:
+        write = temp_file.write
+        write("# Impact Analysis Report\n\n")
+        write(f"**Conversation ID:** `{conversation_id}`\n")
+        write(f"**Generated on:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        write("---\n\n")
+
+        for i, (query, response, tool_calls_json) in enumerate(history):
+            write(f"### Interaction {i+1}\n\n")
+            write(f"**User Query:**\n```\n{query or ''}\n```\n\n")
+
+            # Add tool info if present
+            if tool_calls_json:
+                try:
+                    tool_calls = json_loads(tool_calls_json)
+                    if tool_calls:
+                        write("**Tools used:** ")
+                        write(", ".join(f"`{tc.get('name', 'tool')}`" for tc in tool_calls))
+                        write("\n\n")
+                except:
+                    pass
 
-        report_content += f"**Aurora's Response:**\n{response or ''}\n\n"
-        report_content += "---\n\n"
+            write(f"**Aurora's Response:**\n{response or ''}\n\n")
+            write("---\n\n")
 
-    with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.md', encoding='utf-8') as temp_file:
-        temp_file.write(report_content)
         return temp_file.name
 
 def generate_visualization(conversation_id, db_name, config, repo_path, show_neighbors=False):
@@ -192,88 +792,255 @@ def generate_visualization(conversation_id, db_name, config, repo_path, show_nei
     graph_file_path = get_graph_path(repo_path)
     if not graph_file_path or not os.path.exists(graph_file_path):
         return "```mermaid\ngraph TD;\n  A[Knowledge graph not found. Please build it on the Ingest page.];\n```"
-    
-    with open(graph_file_path, 'r', encoding='utf-8') as f:
-        knowledge_graph = json.load(f)
 
-    node_map = {node['id']: node for node in knowledge_graph['nodes']}
-    history = load_conversation_from_db(db_name, conversation_id)
+    history = load_conversation_messages(db_name, conversation_id)
     if not history:
         return "```mermaid\ngraph TD;\n  A[Could not load conversation history.];\n```"
 
-    # History rows can include (query, response) or (query, response, tool_calls).
-    # Safely concatenate the query and response fields without assuming tuple length.
-    all_text = "".join([str(item[0] or "") + str(item[1] or "") for item in history])
-    all_node_ids = set(node_map.keys())
-    mentioned_nodes = {node_id for node_id in all_node_ids if node_id in all_text}
+    # Each query and response is matched on its own, so the conversation is never copied into one string
+    messages = tuple(str(field or "") for row in history for field in row)
+
+    # The graph file's mtime invalidates cached diagrams whenever the graph is rebuilt
+    graph_mtime = os.stat(graph_file_path).st_mtime_ns
+    return _render_visualization(graph_file_path, graph_mtime, messages, show_neighbors)
+
+# Runs of characters that make up identifier-like node ids (names, dotted modules, file names)
+_NODE_TOKEN_RE = re.compile(r"[\w.\-]+")
+
+def _index_node_ids(node_ids):
+    """
+    Splits node ids for _find_mentioned_nodes into (token_ids, other_ids, max_token_len):
+    ids made only of token characters, the rest, and the longest token id's length.
+    """
+    token_ids = frozenset(node_id for node_id in node_ids if _NODE_TOKEN_RE.fullmatch(node_id))
+    other_ids = tuple(node_id for node_id in node_ids if node_id not in token_ids)
+    return token_ids, other_ids, max(map(len, token_ids), default=0)
+
+def _find_mentioned_nodes(node_index, texts):
+    """
+    Returns the node ids that occur as a substring of any of the texts.
+    Ids made only of token characters always fall inside a single token of a text, so
+    only the texts' distinct tokens are scanned rather than every text once per id.
+    """
+    token_ids, other_ids, max_len = node_index
+    mentioned = {node_id for node_id in other_ids if any(node_id in text for text in texts)}
+    if not token_ids:
+        return mentioned
+
+    tokens = set()
+    for text in texts:
+        tokens.update(_NODE_TOKEN_RE.findall(text))
+    for token in tokens:
+        token_len = len(token)
+        for start in range(token_len):
+            for end in range(start + 1, min(token_len, start + max_len) + 1):
+                if token[start:end] in token_ids:
+                    mentioned.add(token[start:end])
+    return mentioned
+
+# Characters Mermaid does not accept in node ids, mapped to underscores in a single C-level pass
+_MERMAID_ID_TABLE = str.maketrans({'.': '_', '-': '_', ' ': '_'})
+
+# Stand-in for edge endpoints that are not nodes in the graph (e.g. imported modules)
+_UNKNOWN_NODE = {"type": "unknown", "file": "unknown"}
+
+@lru_cache(maxsize=65536)
+def _mermaid_id(node_id):
+    """Returns node_id with the characters Mermaid rejects replaced (memoized, ids recur across edges)."""
+    return node_id.translate(_MERMAID_ID_TABLE)
+
+@lru_cache(maxsize=4)
+def _load_graph(graph_file_path, graph_mtime):
+    """
+    Parses a knowledge graph file into (node_map, node_index, edges, edges_by_node), memoized per
+    file version. node_index is the _index_node_ids split used to find mentioned nodes, and
+    edges_by_node maps each node id to the indexes of the edges it is an endpoint of.
+    """
+    with open(graph_file_path, 'rb') as f:
+        knowledge_graph = json_loads(f.read())
+
+    node_map = {node['id']: node for node in knowledge_graph['nodes']}
+    edges = knowledge_graph['edges']
+    edges_by_node = {}
+    for index, edge in enumerate(edges):
+        edges_by_node.setdefault(edge['source'], []).append(index)
+        if edge['target'] != edge['source']:
+            edges_by_node.setdefault(edge['target'], []).append(index)
+    return node_map, _index_node_ids(node_map), edges, edges_by_node
+
+@lru_cache(maxsize=32)
+def _render_visualization(graph_file_path, graph_mtime, messages, show_neighbors):
+    """Builds the Mermaid diagram for a conversation's messages against a knowledge graph file (memoized)."""
+    node_map, node_index, edges, edges_by_node = _load_graph(graph_file_path, graph_mtime)
+    mentioned_nodes = _find_mentioned_nodes(node_index, messages)
 
     if not mentioned_nodes:
         return "```mermaid\ngraph TD;\n  A[No specific code entities found in this conversation to visualize.];\n```"
 
+    # Only edges touching a mentioned node can qualify; keep them in file order
+    candidate_edges = sorted({index for node_id in mentioned_nodes for index in edges_by_node.get(node_id, ())})
     subgraph_nodes = set(mentioned_nodes)
-    subgraph_edges = []
-    
+
     if show_neighbors:
-        for edge in knowledge_graph['edges']:
-            source, target = edge['source'], edge['target']
-            if source in mentioned_nodes or target in mentioned_nodes:
-                subgraph_nodes.add(source)
-                subgraph_nodes.add(target)
-                subgraph_edges.append(edge)
+        subgraph_edges = [edges[index] for index in candidate_edges]
+        subgraph_nodes.update(node for edge in subgraph_edges for node in (edge['source'], edge['target']))
     else:
-        for edge in knowledge_graph['edges']:
-            source, target = edge['source'], edge['target']
-            if source in subgraph_nodes and target in subgraph_nodes:
-                subgraph_edges.append(edge)
-        edge_nodes = {node for edge in subgraph_edges for node in (edge['source'], edge['target'])}
-        subgraph_nodes = subgraph_nodes.union(edge_nodes)
-
-    mermaid_lines = ["graph TD"]
-    files_to_nodes = {}
-    
-    mermaid_lines.append("  %% Dark Theme Styles")
-    mermaid_lines.append("  classDef fileNode fill:#1e3a5f,stroke:#4fc3f7,stroke-width:2px,color:#fff;")
-    mermaid_lines.append("  classDef classNode fill:#5d4037,stroke:#ffb74d,stroke-width:2px,color:#fff;")
-    mermaid_lines.append("  classDef funcNode fill:#2e4a3a,stroke:#81c784,stroke-width:2px,color:#fff;")
-    mermaid_lines.append("  classDef default fill:#37474f,stroke:#90a4ae,stroke-width:1px,color:#fff;")
-
-    def safe(nid):
-        return nid.replace('.', '_').replace('-', '_').replace(' ', '_')
-
+        # Both endpoints are already mentioned nodes, so no nodes need adding
+        subgraph_edges = [
+            edges[index] for index in candidate_edges
+            if edges[index]['source'] in mentioned_nodes and edges[index]['target'] in mentioned_nodes
+        ]
+
+    # Each node's data is looked up once and kept with it as (node_id, type)
+    files_to_nodes = defaultdict(list)
     for node_id in subgraph_nodes:
-        node_data = node_map.get(node_id, {"type": "unknown", "file": "unknown"})
-        file_parent = node_data.get("file", "unknown")
-        if node_data.get("type") == "file":
-            file_parent = "Files"
-        if file_parent not in files_to_nodes:
-            files_to_nodes[file_parent] = []
-        files_to_nodes[file_parent].append(node_id)
+        node_data = node_map.get(node_id, _UNKNOWN_NODE)
+        n_type = node_data.get("type", "unknown")
+        file_parent = "Files" if n_type == "file" else node_data.get("file", "unknown")
+        files_to_nodes[file_parent].append((node_id, n_type))
+
+    mermaid_lines = [
+        "graph TD",
+        "  %% Dark Theme Styles",
+        "  classDef fileNode fill:#1e3a5f,stroke:#4fc3f7,stroke-width:2px,color:#fff;",
+        "  classDef classNode fill:#5d4037,stroke:#ffb74d,stroke-width:2px,color:#fff;",
+        "  classDef funcNode fill:#2e4a3a,stroke:#81c784,stroke-width:2px,color:#fff;",
+        "  classDef default fill:#37474f,stroke:#90a4ae,stroke-width:1px,color:#fff;",
+    ]
+    append = mermaid_lines.append
 
     for file_group, nodes in files_to_nodes.items():
-        if file_group != "unknown" and file_group != "Files":
-             mermaid_lines.append(f"  subgraph {safe(file_group)} [{file_group}]")
-        for node_id in nodes:
-            node_data = node_map.get(node_id, {})
-            n_type = node_data.get("type", "unknown")
-            s_id = safe(node_id)
+        grouped = file_group != "unknown" and file_group != "Files"
+        if grouped:
+            append(f"  subgraph {_mermaid_id(file_group)} [{file_group}]")
+        for node_id, n_type in nodes:
+            s_id = _mermaid_id(node_id)
             if n_type == 'file':
-                mermaid_lines.append(f"    {s_id}[[{node_id}]]:::fileNode")
+                append(f"    {s_id}[[{node_id}]]:::fileNode")
             elif n_type == 'class':
-                mermaid_lines.append(f"    {s_id}{{{{{node_id}}}}}:::classNode") # Hexagon
+                append(f"    {s_id}{{{{{node_id}}}}}:::classNode") # Hexagon
             elif n_type == 'function':
-                mermaid_lines.append(f"    {s_id}({node_id}):::funcNode") # Rounded
+                append(f"    {s_id}({node_id}):::funcNode") # Rounded
             else:
-                mermaid_lines.append(f"    {s_id}[{node_id}]")
-        if file_group != "unknown" and file_group != "Files":
-            mermaid_lines.append("  end")
+                append(f"    {s_id}[{node_id}]")
+        if grouped:
+            append("  end")
 
     for edge in subgraph_edges:
-        s = safe(edge['source'])
-        t = safe(edge['target'])
-        mermaid_lines.append(f"  {s} -->|{edge.get('type','uses')}| {t}")
+        append(f"  {_mermaid_id(edge['source'])} -->|{edge.get('type','uses')}| {_mermaid_id(edge['target'])}")
 
     return "```mermaid\n" + "\n".join(mermaid_lines) + "\n```"
 
+# --- History Conversion ---
+_USER_ROLE = 'user'
+_MODEL_ROLE = 'model'
+# Gradio role -> Gemini role
+_ROLE_MAP = {'user': _USER_ROLE, 'assistant': _MODEL_ROLE, 'model': _MODEL_ROLE}
+
+_LEADING_SPACE_RE = re.compile(r"\s*")
+
+def build_gemini_history(history):
+    """
+    Converts Gradio chat history (message dicts) into Gemini `types.Content` turns,
+    replaying recorded tool calls as function call/response pairs.
+    """
+    # Bound once, since long histories construct several of each per message
+    Content, Part = types.Content, types.Part
+    FunctionCall, FunctionResponse = types.FunctionCall, types.FunctionResponse
+    role_map = _ROLE_MAP
+    gemini_history = []
+    append = gemini_history.append
+
+    for msg in history or ():
+        role = role_map.get(msg.get('role'))
+        if not role:
+            continue
+        content = msg.get('content')
+
+        if role == _USER_ROLE:
+            append(Content(role=_USER_ROLE, parts=[Part(text=content)]))
+            continue
+
+        # Assistant message
+        metadata = msg.get('metadata')
+        tool_calls = metadata.get("tool_calls") if metadata else None
+        if tool_calls:
+            function_calls_parts = []
+            tool_outputs_parts = []
+            for tc in tool_calls:
+                name = tc['name']
+                args = tc.get('args', {})
+                if isinstance(args, str):
+                    try:
+                        args = json_loads(args)
+                    except json.JSONDecodeError:
+                        args = {}
+                function_calls_parts.append(Part(function_call=FunctionCall(name=name, args=args)))
+                tool_outputs_parts.append(
+                    Part(function_response=FunctionResponse(name=name, response={"result": tc['result']}))
+                )
+            append(Content(role=_MODEL_ROLE, parts=function_calls_parts))
+            append(Content(role=_USER_ROLE, parts=tool_outputs_parts)) # Use 'user' role for function responses
+
+        if content:
+            # Skip content that is just a repeat of the tool call display. The prefix is
+            # matched after any leading whitespace without copying a stripped message.
+            if tool_calls and content.startswith(
+                f"✅ `{tool_calls[0].get('name', 'tool')}`", _LEADING_SPACE_RE.match(content).end()
+            ):
+                continue
+            append(Content(role=_MODEL_ROLE, parts=[Part(text=content)]))
+
+    return gemini_history
+
+def _stored_history_messages(rows):
+    """
+    Converts (query, response, tool_calls_json) rows from load_conversation_from_db
+    into message dicts for build_gemini_history.
+    """
+    messages = []
+    for query, response, tool_calls_json in rows:
+        messages.append({"role": "user", "content": query})
+        assistant_message = {"role": "assistant", "content": response}
+        if tool_calls_json:
+            try:
+                assistant_message["metadata"] = {"tool_calls": json_loads(tool_calls_json)}
+            except (json.JSONDecodeError, TypeError):
+                pass
+        messages.append(assistant_message)
+    return messages
+
+# Tool name -> formatter for the argument shown in tool status lines
+_TOOL_ARG_FORMATTERS = {
+    "read_file": lambda args: f"`{args.get('file_path', '?')}`",
+    "search_knowledge_graph": lambda args: f"query: `{args.get('query', '?')}`",
+    "list_files": lambda args: f"`{args.get('directory_path', 'workspace')}`",
+}
+
+def format_tool_status_detail(func_name, args):
+    """Returns the ' → <argument>' suffix for a tool status line, or '' for tools without one."""
+    formatter = _TOOL_ARG_FORMATTERS.get(func_name)
+    return f" → {formatter(args)}" if formatter else ""
+
+@lru_cache(maxsize=32)
+def get_tool_config(store_name, system_instruction):
+    """
+    Returns the chat session config for a file search store and system prompt.
+    Both are fixed per repository, so the config is built once and shared across sessions.
+    """
+    return types.GenerateContentConfig(
+        tools=[
+            types.Tool(
+                file_search=types.FileSearch(
+                    file_search_store_names=[store_name]
+                ),
+                function_declarations=get_tool_definitions()
+            )
+        ],
+        system_instruction=system_instruction,
+        automatic_function_calling={"disable": True}
+    )
+
 def chat_fn(message, history, chat_session, conversation_id_state, client, repo_path, prompts, config):
 
     """
@@ -304,191 +1071,149 @@ def chat_fn(message, history, chat_session, conversation_id_state, client, repo_
 
         new_conversation_started = True
 
-        conversation_id_state = f"conv_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        # A random suffix keeps IDs unique when several chats start within the same second
+        conversation_id_state = f"conv_{int(time.time())}_{secrets.token_hex(3)}"
 
         print(f"New conversation started with ID: {conversation_id_state}")
 
 
 
-    if not chat_session:
-
-        chat_session = None
-
-        gemini_history = []
-
-        if history:
-
-            for msg in history:
-
-                if isinstance(msg, dict):
-
-                    role = 'model' if msg.get('role') == 'assistant' else msg.get('role')
+    # Serve near-duplicate questions from the semantic cache without calling the model
 
-                    content = msg.get('content')
+    cache_config = config.get("semantic_cache", {})
 
-                    metadata = msg.get('metadata')
+    query_embedding = None
 
-                else: 
+    if cache_config.get("enabled") and message:
 
-                    role = 'model' if getattr(msg, 'role', '') == 'assistant' else getattr(msg, 'role', '')
+        cached_response = None
 
-                    content = getattr(msg, 'content', '')
-
-                    metadata = getattr(msg, 'metadata', None)
-
-
-
-                if not role: continue
-
-                
+        try:
 
-                # User message
+            query_embedding = embed_text(client, db_name, message, cache_config["embedding_model"])
 
-                if role == 'user':
+            cached_response = get_cached_response(
 
-                    gemini_history.append(types.Content(role=role, parts=[types.Part(text=content)]))
+                db_name,
 
-                    continue
+                conversation_id_state,
 
+                query_embedding,
 
+                cache_config.get("max_distance", 0.15),
 
-                # Assistant message
+                cache_config.get("ttl_seconds", 86400)
 
-                tool_calls = []
-
-                if metadata and "tool_calls" in metadata:
+            )
 
-                    tool_calls = metadata["tool_calls"]
+        except Exception as e:
 
-                
+            print(f"Semantic cache lookup failed: {e}")
 
-                if tool_calls:
 
-                    function_calls_parts = []
 
-                    tool_outputs_parts = []
+        if cached_response:
 
-                    for tc in tool_calls:
+            print(f"Semantic cache hit for conversation {conversation_id_state}")
 
-                        args = tc.get('args', {})
+            add_chat_history(db_name, conversation_id_state, message, cached_response, repo_path=repo_path)
 
-                        if isinstance(args, str):
+            # The live session never saw this turn, so drop it and let the next turn rebuild from history.
 
-                            try:
+            evict_session(conversation_id_state)
 
-                                args = json.loads(args)
+            yield cached_response, None, conversation_id_state, new_conversation_started
 
-                            except json.JSONDecodeError:
+            return
 
-                                args = {}
 
-                        
 
-                        function_calls_parts.append(
+    if not chat_session:
 
-                            types.Part(function_call=types.FunctionCall(name=tc['name'], args=args))
+        chat_session = get_cached_session(conversation_id_state)
 
-                        )
 
-                        tool_outputs_parts.append(
 
-                            types.Part(function_response=types.FunctionResponse(name=tc['name'], response={"result": tc['result']}))
+    if not chat_session:
 
-                        )
+        # The chat window may hold only the last chat_history.load_limit interactions, so an
+        # existing conversation replays its full stored transcript to keep the early context.
+        stored_rows = None if new_conversation_started else load_conversation_from_db(db_name, conversation_id_state)
+        gemini_history = build_gemini_history(_stored_history_messages(stored_rows) if stored_rows else history)
 
-                    
 
-                    if function_calls_parts:
 
-                        gemini_history.append(types.Content(role='model', parts=function_calls_parts))
+        tool_config = get_tool_config(store.name, prompts.get("chat_prompt"))
 
-                    if tool_outputs_parts:
 
-                        gemini_history.append(types.Content(role='user', parts=tool_outputs_parts)) # Use 'user' role for function responses
 
+        chat_session = client.chats.create(  # type: ignore
 
+            history=gemini_history,
 
-                if content:
+            model=config["gemini_model"]["chat_model_name"],
 
-                    # Check if the content is just a repeat of the tool call display
+            config=tool_config
 
-                    is_redundant = False
+        )
 
-                    if tool_calls:
 
-                        first_tool_line = f"✅ `{tool_calls[0].get('name', 'tool')}`"
 
-                        if content.strip().startswith(first_tool_line):
+    cache_session(conversation_id_state, chat_session)
 
-                            is_redundant = True
 
 
+    try:
 
-                    if not is_redundant:
+        executed_tool_calls = []
 
-                         gemini_history.append(types.Content(role='model', parts=[types.Part(text=content)]))
+        content = message
 
         
 
-        tool_config = types.GenerateContentConfig(
-
-            tools=[
-
-                types.Tool(
-
-                    file_search=types.FileSearch(
-
-                        file_search_store_names=[store.name]
-
-                    ),
-
-                    function_declarations=get_tool_definitions()
-
-                )
-
-            ],
+        while True:
 
-            system_instruction=prompts.get("chat_prompt"),
+            # Stream the model turn, surfacing text as it arrives and collecting any tool calls
 
-            automatic_function_calling={"disable": True} 
+            response_text = ""
 
-        )
+            function_calls = []
 
-        
+            grounding = None
 
-        chat_session = client.chats.create(  # type: ignore
+            for chunk in stream_message_with_retry(chat_session, content):
 
-            history=gemini_history,
+                if not chunk.candidates:
 
-            model=config["gemini_model"]["chat_model_name"],
-
-            config=tool_config
+                    continue
 
-        )
+                candidate = chunk.candidates[0]
 
+                if candidate.grounding_metadata:
 
+                    grounding = candidate.grounding_metadata
 
-    try:
+                if not (candidate.content and candidate.content.parts):
 
-        executed_tool_calls = []
+                    continue
 
-        
+                text_received = False
 
-        response = send_message_with_retry(chat_session, message)
+                for part in candidate.content.parts:
 
-        
+                    if part.function_call:
 
-        while True:
+                        function_calls.append(part.function_call)
 
-            function_calls = []
+                    elif part.text:
 
-            if response.candidates and response.candidates[0].content.parts:
+                        response_text += part.text
 
-                for part in response.candidates[0].content.parts:
+                        text_received = True
 
-                    if part.function_call:
+                if text_received and not function_calls:
 
-                        function_calls.append(part.function_call)
+                    yield response_text, chat_session, conversation_id_state, new_conversation_started
 
             
 
@@ -510,25 +1235,7 @@ def chat_fn(message, history, chat_session, conversation_id_state, client, repo_
 
                 # Build descriptive status with tool arguments
 
-                if func_name == "read_file":
-
-                    arg_desc = f"`{func_args.get('file_path', '?')}`"
-
-                elif func_name == "search_knowledge_graph":
-
-                    arg_desc = f"query: `{func_args.get('query', '?')}`"
-
-                elif func_name == "list_files":
-
-                    arg_desc = f"`{func_args.get('directory_path', 'workspace')}`"
-
-                else:
-
-                    arg_desc = ""
-
-                
-
-                status_detail = f" → {arg_desc}" if arg_desc else ""
+                status_detail = format_tool_status_detail(func_name, func_args)
 
                 yield f"🛠️ `{func_name}`{status_detail}...", chat_session, conversation_id_state, new_conversation_started
 
@@ -602,19 +1309,7 @@ def chat_fn(message, history, chat_session, conversation_id_state, client, repo_
 
             yield "🧠 Processing tool outputs...", chat_session, conversation_id_state, new_conversation_started
 
-            response = send_message_with_retry(chat_session, tool_outputs)
-
-
-
-        response_text = ""
-
-        if response.candidates and response.candidates[0].content.parts:
-
-            for part in response.candidates[0].content.parts:
-
-                if part.text:
-
-                    response_text += part.text
+            content = tool_outputs
 
 
 
@@ -644,21 +1339,17 @@ def chat_fn(message, history, chat_session, conversation_id_state, client, repo_
 
     try:
 
-        if response.candidates:
-
-            grounding = response.candidates[0].grounding_metadata
+        if grounding and grounding.grounding_chunks:
 
-            if grounding and grounding.grounding_chunks:
+            sources = {chunk.retrieved_context.title for chunk in grounding.grounding_chunks}
 
-                sources = {chunk.retrieved_context.title for chunk in grounding.grounding_chunks}
+            if sources:
 
-                if sources:
+                yield f"📚 `file_search` → found {len(sources)} source{'s' if len(sources) > 1 else ''}", chat_session, conversation_id_state, new_conversation_started
 
-                    yield f"📚 `file_search` → found {len(sources)} source{'s' if len(sources) > 1 else ''}", chat_session, conversation_id_state, new_conversation_started
+                citations = "\n\n**Sources:**\n" + "\n".join(f"- `{source}`" for source in sorted(sources))
 
-                    citations = "\n\n**Sources:**\n" + "\n".join(f"- `{source}`" for source in sorted(list(sources)))
-
-                    response_text += citations
+                response_text += citations
 
     except (AttributeError, IndexError):
 
@@ -666,28 +1357,40 @@ def chat_fn(message, history, chat_session, conversation_id_state, client, repo_
 
 
 
-    if message and (response_text or executed_tool_calls) and conversation_id_state:
+    display_text = response_text if response_text else "(No response text generated by the model.)"
+
 
-        add_chat_history(
 
-            db_name,
+    # Persist after handing the response back, so the writes never delay it.
 
-            conversation_id_state,
+    # The finally block still runs if the consumer closes the generator early.
 
-            message,
+    try:
 
-            response_text,
+        yield display_text, chat_session, conversation_id_state, new_conversation_started
 
-            repo_path=repo_path,
+    finally:
 
-            tool_calls=executed_tool_calls
+        if message and (response_text or executed_tool_calls) and conversation_id_state:
 
-        )
+            add_chat_history(
 
+                db_name,
+
+                conversation_id_state,
+
+                message,
+
+                response_text,
+
+                repo_path=repo_path,
+
+                tool_calls=executed_tool_calls
+
+            )
 
 
-    if not response_text:
 
-        response_text = "(No response text generated by the model.)"
+            if query_embedding is not None and response_text:
 
-    yield response_text, chat_session, conversation_id_state, new_conversation_started
\ No newline at end of file
+                add_cached_response(db_name, conversation_id_state, query_embedding, response_text)
\ No newline at end of file
@@ -1,21 +1,85 @@
 import os
 import time
+import random
 import json
 import ast
+import sys
+import hashlib
+import mmap
+import multiprocessing
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from core.store_utils import get_or_create_store
-from core.tools import get_tool_definitions, list_files, read_file, search_knowledge_graph, set_workspace_path, get_repositories, get_graph_path
+from core.tools import get_tool_definitions, list_files, read_file, search_knowledge_graph, set_workspace_path, get_repositories, get_graph_path, get_graph_index_path, write_graph_index, json_dumpb
 
 
 
-def ingest_files(directory_path, client, _, config): # store arg is ignored/deprecated
+def _iter_files(root, ignored_dirs, ignored_files, extensions=()):
+    """
+    Yields the paths of files under root, in the same top-down order as os.walk.
+    Ignored directories are pruned before descending, and hidden or ignored files are skipped.
+    An empty extensions tuple allows every extension.
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if entry.is_dir():
+                        # Like os.walk, symlinked directories are listed but never descended into
+                        if name not in ignored_dirs and not entry.is_symlink():
+                            subdirs.append(entry.path)
+                        continue
+                    if name.startswith('.') or name in ignored_files:
+                        continue
+                    if extensions and not name.endswith(extensions):
+                        continue
+                    yield entry.path
+        except OSError:
+            continue
+        stack.extend(reversed(subdirs))
+
+# Minimum seconds between throttled updates of a streamed log (at most 5 UI updates per second)
+_LOG_FLUSH_INTERVAL = 0.2
+
+class _ProgressLog:
+    """
+    Accumulates the messages of a streamed progress log. Each update re-sends the whole log,
+    so per-file messages are throttled to keep large repositories from doing O(N²) joins.
+    """
+    def __init__(self):
+        self.messages = []
+        self._last_flush = 0.0
+
+    def _due(self):
+        return time.monotonic() - self._last_flush >= _LOG_FLUSH_INTERVAL
+
+    def _render(self, lines):
+        self._last_flush = time.monotonic()
+        return "\n".join(lines)
+
+    def __call__(self, message, throttle=False):
+        """Adds message to the log and returns the full log text, or None if throttled and an update was sent recently."""
+        self.messages.append(message)
+        if throttle and not self._due():
+            return None
+        return self._render(self.messages)
+
+    def progress(self, message, throttle=False):
+        """Returns the log text with a transient status line shown below it without being kept, or None if throttled."""
+        if throttle and not self._due():
+            return None
+        return self._render(self.messages + [message])
+
+def ingest_files(directory_path, client, config):
     """
     Finds all files in a directory, uploads them to the file search store,
     yields progress, and waits for completion.
     """
-    log_messages = []
-    def log(message):
-        log_messages.append(message)
-        return "\n".join(log_messages)
+    log = _ProgressLog()
 
     if not directory_path or not os.path.isdir(directory_path):
         yield log("❌ Error: Please provide a valid directory path.")
@@ -33,22 +97,12 @@ def ingest_files(directory_path, client, _, config): # store arg is ignored/depr
     print(f"Scanning directory: {directory_path}")
 
     # Find all files in the directory
-    all_files = []
-    ignored_dirs = config["ingestion"]["ignored_directories"]
-    ignored_files = config["ingestion"].get("ignored_files", [])
-    allowed_extensions = config["ingestion"].get("allowed_extensions", [])
-
-    for root, dirs, files in os.walk(directory_path):
-        # Remove ignored directories from the search
-        dirs[:] = [d for d in dirs if d not in ignored_dirs]
-        for file in files:
-            if file.startswith('.'):
-                continue
-            if file in ignored_files:
-                continue
-            if allowed_extensions and not any(file.endswith(ext) for ext in allowed_extensions):
-                continue
-            all_files.append(os.path.join(root, file))
+    all_files = list(_iter_files(
+        directory_path,
+        set(config["ingestion"]["ignored_directories"]),
+        set(config["ingestion"].get("ignored_files", [])),
+        tuple(config["ingestion"].get("allowed_extensions", []))
+    ))
 
     if not all_files:
         yield log("No files found in the specified directory.")
@@ -58,118 +112,259 @@ def ingest_files(directory_path, client, _, config): # store arg is ignored/depr
     yield log(f"Found {total_files} files. Ingesting... This may take a few minutes.")
     print(f"Ingesting {total_files} files...")
 
-    # Process one file at a time
-    for i, file_path in enumerate(all_files):
-        file_name = os.path.basename(file_path)
-        progress_prefix = f"[{i+1}/{total_files}]"
-        yield log(f"{progress_prefix} Uploading `{file_name}`...")
-        print(f"Uploading: {file_name} from {file_path}")
+    mime_type_map = config.get("mime_type_map", {})
 
+    def start_upload(file_path):
+        file_name = os.path.basename(file_path)
+        file_ext = os.path.splitext(file_name)[1].lower()
+        # Default to plain text if mime type is not mapped
+        upload_config = {'display_name': file_name, 'mime_type': mime_type_map.get(file_ext, 'text/plain')}
+        print(f"Uploading: {file_name} from {file_path} (mime_type='{upload_config['mime_type']}')")
+        # This call returns a long-running indexing operation
+        return client.file_search_stores.upload_to_file_search_store(
+            file_search_store_name=store.name,
+            file=file_path,
+            config=upload_config
+        )
+
+    # Upload all files concurrently and collect their indexing operations
+    pending = {}
+    # More workers than pooled connections would just queue on the client's HTTP pool
+    max_workers = min(
+        config["ingestion"].get("upload_concurrency", 8),
+        config.get("http_pool", {}).get("max_connections", 32)
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(start_upload, file_path): file_path for file_path in all_files}
+        for future in as_completed(futures):
+            file_path = futures[future]
+            try:
+                pending[file_path] = future.result()
+            except Exception as e:
+                yield log(f"❌ Error uploading `{os.path.basename(file_path)}`: {e}")
+                print(f"Error uploading {file_path}: {e}")
+                continue
+            text = log.progress(f"Uploaded {len(pending)}/{total_files} files...", throttle=True)
+            if text:
+                yield text
+
+    # Poll all outstanding operations together instead of waiting on each file in turn
+    indexed = 0
+    poll_delay = 0.25
+    while True:
+        for file_path, operation in list(pending.items()):
+            if operation.done:
+                del pending[file_path]
+                indexed += 1
+        yield log.progress(f"Indexed {indexed}/{total_files} files...")
+        if not pending:
+            break
+
+        # Exponential backoff with jitter: small files finish well before a fixed 4s tick
+        time.sleep(poll_delay + random.random() * 0.1)
+        poll_delay = min(poll_delay * 1.5, 4.0)
+        for file_path, operation in list(pending.items()):
+            try:
+                pending[file_path] = client.operations.get(operation)
+            except Exception as e:
+                del pending[file_path]
+                yield log(f"❌ Error indexing `{os.path.basename(file_path)}`: {e}")
+                print(f"Error indexing {file_path}: {e}")
+
+    yield log(f"✅ Ingestion complete: indexed {indexed}/{total_files} files. You can now use the Chat tab.")
+
+
+def analyze_tree(tree, file_name):
+    """
+    Extracts nodes (files, functions, classes) and edges (imports, calls) from a parsed Python module.
+    Walks the AST iteratively with type() dispatch instead of ast.NodeVisitor's per-node method lookup,
+    visiting nodes in the same order. Returns (nodes, edges); edges is an insertion-ordered dict of
+    (source, target, type) tuples, which deduplicates while keeping first-seen order.
+    """
+    FunctionDef, AsyncFunctionDef, ClassDef = ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef
+    Import, ImportFrom, Call, Name, AST = ast.Import, ast.ImportFrom, ast.Call, ast.Name, ast.AST
+    nodes = []
+    edges = {}
+    stack = [(tree, file_name)]  # (node, enclosing scope), starting with file-level scope
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        node, scope = pop()
+        node_type = type(node)
+        if node_type is Call:
+            # This is a simplified call analysis. It captures direct function names.
+            func = node.func
+            if type(func) is Name:
+                edges[(scope, func.id, "calls")] = None
+        elif node_type is FunctionDef or node_type is AsyncFunctionDef or node_type is ClassDef:
+            nodes.append({"id": node.name, "type": "class" if node_type is ClassDef else "function", "file": file_name})
+            scope = node.name
+        elif node_type is Import:
+            for alias in node.names:
+                edges[(file_name, alias.name, "imports")] = None
+            continue
+        elif node_type is ImportFrom:
+            if node.module:
+                edges[(file_name, node.module, "imports")] = None
+            continue
+
+        # Push children in reverse so they are popped in source order
+        for field in reversed(node._fields):
+            value = getattr(node, field, None)
+            if type(value) is list:
+                for item in reversed(value):
+                    if isinstance(item, AST):
+                        push((item, scope))
+            elif isinstance(value, AST):
+                push((value, scope))
+    return nodes, edges
+
+
+# Bump when analyze_tree's output changes, so stale cached analyses are not reused
+_ANALYSIS_CACHE_VERSION = 3
+
+# Cached analyses are shared by every repository, so they are pruned by age (refreshed on each
+# hit) and by count rather than by what the latest build used
+_ANALYSIS_CACHE_MAX_AGE = 30 * 24 * 3600  # seconds since an entry was last used
+_ANALYSIS_CACHE_MAX_ENTRIES = 50000
+
+def _get_analysis_cache_dir():
+    """Returns the directory holding cached per-file analyses, creating it if needed."""
+    cache_dir = os.path.join(os.getcwd(), "data", "ast_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def _prune_analysis_cache(cache_dir):
+    """
+    Deletes cached analyses unused for _ANALYSIS_CACHE_MAX_AGE, then the least recently used
+    ones beyond _ANALYSIS_CACHE_MAX_ENTRIES. Returns the number of entries removed.
+    """
+    cutoff = time.time() - _ANALYSIS_CACHE_MAX_AGE
+    entries = []
+    removed = 0
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            entries.append((mtime, entry.path))
+
+    entries.sort(reverse=True)
+    for index, (mtime, path) in enumerate(entries):
+        if mtime < cutoff or index >= _ANALYSIS_CACHE_MAX_ENTRIES:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+def _analyze_source(file_name, source, cache_dir):
+    """
+    Returns (nodes, edges, cache_hit) for a Python file's source bytes (bytes or an mmap), or
+    (None, None, False) if the file is blank. Results are cached on disk keyed by a SHA-256 of the
+    file name and source bytes, so unchanged files skip decoding, ast.parse and the visit.
+    """
+    hasher = hashlib.sha256(file_name.encode('utf-8') + b"\0")
+    hasher.update(source)
+    key = f"{hasher.hexdigest()}_py{sys.version_info[0]}{sys.version_info[1]}_v{_ANALYSIS_CACHE_VERSION}"
+    cache_path = os.path.join(cache_dir, f"{key}.json")
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        # Mark the entry as used, so pruning keeps it
         try:
-            upload_config = {'display_name': file_name}
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return cached["nodes"], [tuple(edge) for edge in cached["edges"]], True
+    except (OSError, ValueError, KeyError):
+        pass
+
+    content = str(source, 'utf-8', 'ignore')
+    if not content.strip():
+        return None, None, False
+
+    tree = ast.parse(content)
+    nodes, edges = analyze_tree(tree, file_name)
+    edges = list(edges)
+    try:
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump({"nodes": nodes, "edges": edges}, f)
+    except OSError as e:
+        print(f"Could not cache analysis for {file_name}: {e}")
+    return nodes, edges, False
 
-            # Get file extension and map to mime type
-            mime_type_map = config.get("mime_type_map", {})
-            file_ext = os.path.splitext(file_name)[1].lower()
+# Files at least this large are memory-mapped instead of read into a bytes copy
+_MMAP_MIN_BYTES = 64 * 1024
 
-            if file_ext in mime_type_map:
-                upload_config['mime_type'] = mime_type_map[file_ext]
-            else:
-                # Default to plain text if mime type is not mapped
-                upload_config['mime_type'] = 'text/plain'
-
-            print(f"DEBUG: File '{file_name}' ext='{file_ext}' mime_type='{upload_config['mime_type']}'")
-
-            # This call should return a long-running operation
-            operation = client.file_search_stores.upload_to_file_search_store(
-                file_search_store_name=store.name,
-                file=file_path,
-                config=upload_config
-            )
-
-            # Wait for the current file's operation to complete before proceeding
-            yield log(f"{progress_prefix} Indexing `{file_name}`...")
-            while not operation.done:
-                time.sleep(4)
-                operation = client.operations.get(operation)
-
-            yield log(f"✅ {progress_prefix} Indexed `{file_name}`")
-        except Exception as e:
-            yield log(f"❌ {progress_prefix} Error indexing `{file_name}`: {e}")
-            print(f"Error indexing {file_name}: {e}")
-
-    yield log(f"✅ Ingestion complete for {total_files} files. You can now use the Chat tab.")
-
-
-class CodeAnalyzer(ast.NodeVisitor):
-    """
-    An AST node visitor that extracts nodes (files, functions, classes)
-    and edges (imports, calls) from Python code.
-    """
-    def __init__(self, file_name):
-        self.file_name = file_name
-        self.nodes = []
-        self.edges = []
-        self.current_scope = file_name  # Start with file-level scope
-
-    def visit_FunctionDef(self, node):
-        self.nodes.append({"id": node.name, "type": "function", "file": self.file_name})
-        parent_scope = self.current_scope
-        self.current_scope = node.name
-        self.generic_visit(node)
-        self.current_scope = parent_scope
-
-    def visit_ClassDef(self, node):
-        self.nodes.append({"id": node.name, "type": "class", "file": self.file_name})
-        parent_scope = self.current_scope
-        self.current_scope = node.name
-        self.generic_visit(node)
-        self.current_scope = parent_scope
-
-    def visit_Import(self, node):
-        for alias in node.names:
-            self.edges.append({"source": self.file_name, "target": alias.name, "type": "imports"})
-        self.generic_visit(node)
-
-    def visit_ImportFrom(self, node):
-        if node.module:
-            self.edges.append({"source": self.file_name, "target": node.module, "type": "imports"})
-        self.generic_visit(node)
-
-    def visit_Call(self, node):
-        # This is a simplified call analysis. It captures direct function names.
-        if isinstance(node.func, ast.Name):
-            self.edges.append({"source": self.current_scope, "target": node.func.id, "type": "calls"})
-        self.generic_visit(node)
+def _analyze_file(file_path, cache_dir):
+    """
+    Reads and analyzes one Python file (runs in a worker process for large repositories).
+    Returns (file_name, has_content, nodes, edges, cache_hit, error); has_content is False for
+    empty or unreadable files, and error holds the message if reading or analysis failed.
+    """
+    file_name = os.path.basename(file_path)
+    try:
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return file_name, False, [], [], False, None
+            # Large files are hashed and decoded straight from the page cache
+            source = f.read() if size < _MMAP_MIN_BYTES else mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception as e:
+        return file_name, False, [], [], False, str(e)
+
+    try:
+        # Parse the code and analyze it, reusing the cached result for unchanged files
+        nodes, edges, cache_hit = _analyze_source(file_name, source, cache_dir)
+        if nodes is None:
+            return file_name, False, [], [], False, None
+        return file_name, True, nodes, edges, cache_hit, None
+    except Exception as e:
+        return file_name, True, [], [], False, str(e)
+    finally:
+        if isinstance(source, mmap.mmap):
+            source.close()
+
+# Smaller repositories are analyzed in-process; worker start-up would outweigh the gain
+_PARALLEL_ANALYSIS_MIN_FILES = 32
+
+def _analyze_files(file_paths, cache_dir):
+    """Yields _analyze_file results in input order, fanning out across CPU cores for large repositories."""
+    if len(file_paths) < _PARALLEL_ANALYSIS_MIN_FILES:
+        for file_path in file_paths:
+            yield _analyze_file(file_path, cache_dir)
+        return
 
+    # Never plain fork: the server process has live threads (event loop, history writer, HTTP
+    # pool), and a forked child could inherit a lock one of them held. Workers start from a
+    # clean interpreter instead, which is why app.py keeps its startup under __main__.
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context(start_method)) as executor:
+        yield from executor.map(_analyze_file, file_paths, repeat(cache_dir), chunksize=16)
 
 def build_knowledge_graph(directory_path, config):
     """
     Scans a directory, uses Python's AST module to extract entities and relationships
     from .py files, and builds a knowledge graph.
     """
-    log_messages = []
-    def log(message):
-        log_messages.append(message)
-        return "\n".join(log_messages)
+    log = _ProgressLog()
 
     if not directory_path or not os.path.isdir(directory_path):
         yield log("❌ Error: Please provide a valid directory path to build the graph.")
         return
 
     yield log(f"Scanning directory for graph construction: {directory_path}")
-    python_files = []
-    ignored_dirs = config["ingestion"]["ignored_directories"]
-    ignored_files = config["ingestion"].get("ignored_files", [])
-    for root, dirs, files in os.walk(directory_path):
-        dirs[:] = [d for d in dirs if d not in ignored_dirs]
-        for file in files:
-            if file.startswith('.'):
-                continue
-            if file in ignored_files:
-                continue
-            if file.endswith(".py"):
-                python_files.append(os.path.join(root, file))
+    python_files = list(_iter_files(
+        directory_path,
+        set(config["ingestion"]["ignored_directories"]),
+        set(config["ingestion"].get("ignored_files", [])),
+        (".py",)
+    ))
 
     if not python_files:
         yield log("No Python (.py) files found to build graph.")
@@ -178,41 +373,49 @@ def build_knowledge_graph(directory_path, config):
     yield log(f"Found {len(python_files)} Python files. Building knowledge graph...")
     knowledge_graph = {"nodes": [], "edges": []}
     existing_node_ids = set()
+    # Edges are deduplicated as (source, target, type) tuples while aggregating
+    all_edges = {}
+    cache_dir = _get_analysis_cache_dir()
+    cache_hits = 0
+
+    for file_name, has_content, nodes, edges, cache_hit, error in _analyze_files(python_files, cache_dir):
+        text = log(f"Analyzing `{file_name}`...", throttle=True)
+        if text:
+            yield text
+        if not has_content:
+            if error:
+                yield log(f"❌ Error analyzing `{file_name}`: {error}")
+            else:
+                text = log(f"Skipping empty file: `{file_name}`", throttle=True)
+                if text:
+                    yield text
+            continue
+
+        # Add the file itself as a node
+        if file_name not in existing_node_ids:
+            knowledge_graph["nodes"].append({"id": file_name, "type": "file", "file": file_name})
+            existing_node_ids.add(file_name)
+
+        if error:
+            yield log(f"❌ Error analyzing `{file_name}`: {error}")
+            continue
+        cache_hits += cache_hit
+
+        # Aggregate nodes and edges, avoiding duplicates
+        for node in nodes:
+            if node.get("id") not in existing_node_ids:
+                knowledge_graph["nodes"].append(node)
+                existing_node_ids.add(node.get("id"))
+        all_edges.update(dict.fromkeys(edges))
 
-    for file_path in python_files:
-        file_name = os.path.basename(file_path)
-        yield log(f"Analyzing `{file_name}`...")
-        try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-
-            if not content.strip():
-                yield log(f"Skipping empty file: `{file_name}`")
-                continue
-
-            # Add the file itself as a node
-            if file_name not in existing_node_ids:
-                knowledge_graph["nodes"].append({"id": file_name, "type": "file", "file": file_name})
-                existing_node_ids.add(file_name)
-
-            # Parse the code and analyze it
-            tree = ast.parse(content)
-            analyzer = CodeAnalyzer(file_name)
-            analyzer.visit(tree)
-
-            # Aggregate nodes and edges, avoiding duplicates
-            for node in analyzer.nodes:
-                if node.get("id") not in existing_node_ids:
-                    knowledge_graph["nodes"].append(node)
-                    existing_node_ids.add(node.get("id"))
-            knowledge_graph["edges"].extend(analyzer.edges)
-
-        except Exception as e:
-            yield log(f"❌ Error analyzing `{file_name}`: {e}")
+    try:
+        pruned = _prune_analysis_cache(cache_dir)
+        if pruned:
+            yield log(f"Removed {pruned} stale cached analyses.")
+    except OSError as e:
+        print(f"Could not prune the analysis cache: {e}")
 
-    # Remove duplicates from edges
-    unique_edges = {f"{e['source']}-{e['target']}-{e['type']}": e for e in knowledge_graph["edges"]}
-    knowledge_graph["edges"] = list(unique_edges.values())
+    knowledge_graph["edges"] = [{"source": s, "target": t, "type": k} for s, t, k in all_edges]
 
     graph_file_path = get_graph_path(directory_path)
 
@@ -221,16 +424,27 @@ def build_knowledge_graph(directory_path, config):
         return
 
     try:
-        with open(graph_file_path, 'w', encoding='utf-8') as f:
-            json.dump(knowledge_graph, f, indent=2)
-        yield log(f"✅ Knowledge graph built successfully and saved to `{graph_file_path}`.")
+        with open(graph_file_path, 'wb') as f:
+            f.write(json_dumpb(knowledge_graph, pretty=True))
+        yield log(
+            f"✅ Knowledge graph built successfully and saved to `{graph_file_path}` "
+            f"({cache_hits} cached, {len(python_files) - cache_hits} analyzed)."
+        )
     except Exception as e:
         yield log(f"❌ Error saving knowledge graph: {e}")
+        return
+
+    try:
+        write_graph_index(get_graph_index_path(directory_path), knowledge_graph)
+        yield log("✅ Search index updated.")
+    except Exception as e:
+        yield log(f"⚠️ Could not build the search index, searches will scan the JSON graph: {e}")
 
 
 def view_knowledge_graph(config, repo_path):
     """
     Reads the knowledge graph from the JSON file and returns it for display.
+    The file is written indented by build_knowledge_graph, so it is shown as-is without re-parsing.
     """
     if not repo_path:
         return None, "❌ Error: No repository selected."
@@ -245,8 +459,7 @@ def view_knowledge_graph(config, repo_path):
 
     try:
         with open(graph_file_path, 'r', encoding='utf-8') as f:
-            graph_data = json.load(f)
-        json_string = json.dumps(graph_data, indent=2)
+            json_string = f.read()
         return json_string, "✅ Knowledge graph loaded."
     except Exception as e:
-        return None, f"❌ Error reading or parsing knowledge graph file: {e}"
\ No newline at end of file
+        return None, f"❌ Error reading knowledge graph file: {e}"
\ No newline at end of file
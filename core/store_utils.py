@@ -1,4 +1,21 @@
 import os
+import threading
+import time
+from core.tools import json_dumpb, json_loads
+
+# Stores can be created or deleted outside this process (cleanup_stores.py, another
+# instance), so cached lookups are re-validated after this many seconds
+_STORE_CACHE_TTL = 300
+# display_name -> store, populated from a single file_search_stores.list() call
+_store_cache = None
+_store_cache_time = 0.0
+# display_name -> (fetched_at, store), resolved by name from the persisted index without listing
+_indexed_stores = {}
+_store_cache_lock = threading.Lock()
+
+# Persisted display_name -> store name mapping, so a cold start can fetch a known store directly
+_STORE_INDEX_PATH = os.path.join("data", "store_index.json")
+_store_index = None
 
 def get_store_name(directory_path):
     """Generates a consistent store display name based on the directory path."""
@@ -9,6 +26,79 @@ def get_store_name(directory_path):
     folder_name = os.path.basename(os.path.abspath(directory_path))
     return f"Aurora Store - {folder_name}"
 
+def _load_store_index():
+    """Returns the persisted display_name -> store name mapping, reading it from disk once. Call with the lock held."""
+    global _store_index
+    if _store_index is None:
+        try:
+            with open(_STORE_INDEX_PATH, 'rb') as f:
+                _store_index = json_loads(f.read())
+        except (OSError, ValueError):
+            _store_index = {}
+    return _store_index
+
+def _update_store_index(display_name, store_name):
+    """Sets (or removes, if store_name is None) an entry in the persisted store index. Call with the lock held."""
+    index = _load_store_index()
+    if index.get(display_name) == store_name:
+        return
+    if store_name is None:
+        del index[display_name]
+    else:
+        index[display_name] = store_name
+    try:
+        os.makedirs(os.path.dirname(_STORE_INDEX_PATH), exist_ok=True)
+        tmp_path = f"{_STORE_INDEX_PATH}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(json_dumpb(index))
+        os.replace(tmp_path, _STORE_INDEX_PATH)
+    except OSError as e:
+        print(f"Could not save store index: {e}")
+
+def _get_indexed_store(client, display_name):
+    """
+    Fetches a store by the name recorded in the persisted index, skipping the full listing.
+    Returns None if the store is not indexed or no longer exists.
+    """
+    with _store_cache_lock:
+        cached = _indexed_stores.get(display_name)
+        if cached and time.monotonic() - cached[0] < _STORE_CACHE_TTL:
+            return cached[1]
+        store_name = _load_store_index().get(display_name)
+    if not store_name:
+        return None
+
+    try:
+        store = client.file_search_stores.get(name=store_name)
+    except Exception as e:
+        print(f"Indexed store {store_name} is unavailable, re-listing stores: {e}")
+        store = None
+    with _store_cache_lock:
+        if store is None or store.display_name != display_name:
+            _update_store_index(display_name, None)
+            return None
+        _indexed_stores[display_name] = (time.monotonic(), store)
+    return store
+
+def _list_stores(client):
+    """
+    Returns a display_name -> store mapping of all file search stores.
+    The listing is reused until clear_store_cache() is called or _STORE_CACHE_TTL expires.
+    """
+    global _store_cache, _store_cache_time
+    with _store_cache_lock:
+        if _store_cache is None or time.monotonic() - _store_cache_time >= _STORE_CACHE_TTL:
+            _store_cache = {store.display_name: store for store in client.file_search_stores.list()}
+            _store_cache_time = time.monotonic()
+        return _store_cache
+
+def clear_store_cache():
+    """Forces the next store lookup to re-list stores from the API."""
+    global _store_cache
+    with _store_cache_lock:
+        _store_cache = None
+        _indexed_stores.clear()
+
 def get_or_create_store(client, directory_path):
     """
     Gets the file search store for a specific repository or creates it if it doesn't exist.
@@ -16,14 +106,35 @@ def get_or_create_store(client, directory_path):
     store_display_name = get_store_name(directory_path)
     print(f"--- Accessing Store: {store_display_name} ---")
 
-    # Check if the store already exists
-    # Note: listing all stores might be slow if there are many. 
-    # For a personal tool, this is acceptable.
-    for store in client.file_search_stores.list():
-        if store.display_name == store_display_name:
-            # print(f"Found existing store: {store.name}")
+    # Before the first listing, try fetching the store directly by its persisted name
+    if _store_cache is None:
+        store = _get_indexed_store(client, store_display_name)
+        if store:
             return store
 
-    # If not found, create a new one
-    print(f"Store not found, creating a new one: {store_display_name}")
-    return client.file_search_stores.create(config={'display_name': store_display_name})
+    stores = _list_stores(client)
+    store = stores.get(store_display_name)
+    if not store:
+        # If not found, create a new one
+        print(f"Store not found, creating a new one: {store_display_name}")
+        store = client.file_search_stores.create(config={'display_name': store_display_name})
+    with _store_cache_lock:
+        stores[store_display_name] = store
+        _update_store_index(store_display_name, store.name)
+    return store
+
+def delete_store(client, directory_path):
+    """
+    Deletes the file search store for a specific repository, if it exists.
+    Returns True if a store was deleted.
+    """
+    store_display_name = get_store_name(directory_path)
+    store = _list_stores(client).get(store_display_name)
+    if not store:
+        return False
+
+    client.file_search_stores.delete(name=store.name, config={'force': True})
+    clear_store_cache()
+    with _store_cache_lock:
+        _update_store_index(store_display_name, None)
+    return True
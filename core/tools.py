@@ -1,10 +1,30 @@
 import os
 import json
 import ast
+import sqlite3
+from contextlib import closing
 import yaml # Added import
 
-# Tool Definitions for Gemini
-from google.genai import types
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_dumps(obj, pretty=False):
+    """Serializes obj to a JSON string (indented by 2 if pretty), using orjson when it is installed."""
+    return json_dumpb(obj, pretty).decode()
+
+def json_dumpb(obj, pretty=False):
+    """Serializes obj to UTF-8 JSON bytes (indented by 2 if pretty), using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else None)
+    return json.dumps(obj, indent=2 if pretty else None).encode('utf-8')
+
+def json_loads(data):
+    """Parses a JSON str or bytes, using orjson when it is installed. Errors are json.JSONDecodeError."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 # Global state for the active workspace
 _WORKSPACE_PATH = "."
@@ -23,6 +43,8 @@ def set_workspace_path(path):
     return f"Workspace path set to: {_WORKSPACE_PATH}"
 
 import hashlib
+from functools import lru_cache
+from urllib.request import pathname2url
 
 def get_graph_path(repo_path):
     """
@@ -32,37 +54,89 @@ def get_graph_path(repo_path):
     if not repo_path:
         return None
     
-    # Create a unique filename based on the repository path
+    # Store in data/graphs/ relative to the application root
+    # Assuming running from 'aurora' root directory
+    return _graph_path_in(os.getcwd(), repo_path)
+
+@lru_cache(maxsize=64)
+def _graph_path_in(root_dir, repo_path):
+    """Derives the graph path under root_dir once per repository, so repeat calls skip hashing and makedirs."""
+    # Create a unique filename based on the repository path. MD5 is kept so existing graphs stay addressable.
     repo_hash = hashlib.md5(repo_path.encode('utf-8')).hexdigest()
     filename = f"graph_{repo_hash}.json"
     
-    # Store in data/graphs/ relative to the application root
-    # Assuming running from 'aurora' root directory
-    base_dir = os.path.join(os.getcwd(), "data", "graphs")
+    base_dir = os.path.join(root_dir, "data", "graphs")
     os.makedirs(base_dir, exist_ok=True)
     
     return os.path.join(base_dir, filename)
 
+_REPOS_FILE = "repositories.json"
+_REPOS_CACHE = None  # (st_mtime_ns, list of repository paths)
+
 def get_repositories():
-    """Available repositories from persistent storage."""
-    repo_file = "repositories.json"
-    if os.path.exists(repo_file):
-        with open(repo_file, "r") as f:
-            return json.load(f)
-    return []
+    """Available repositories from persistent storage, re-read only when the file's mtime changes."""
+    global _REPOS_CACHE
+    try:
+        mtime = os.stat(_REPOS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    if _REPOS_CACHE is None or _REPOS_CACHE[0] != mtime:
+        with open(_REPOS_FILE, "rb") as f:
+            _REPOS_CACHE = (mtime, json_loads(f.read()))
+    # Hand out a copy so callers can't modify the cached list
+    return list(_REPOS_CACHE[1])
 
 def add_repository(path):
     """Adds a repository path to persistent storage if it exists."""
+    global _REPOS_CACHE
     if not os.path.exists(path):
          return False
     
     repos = get_repositories()
     if path not in repos:
         repos.append(path)
-        with open("repositories.json", "w") as f:
-            json.dump(repos, f)
+        with open(_REPOS_FILE, "wb") as f:
+            f.write(json_dumpb(repos))
+        # Coarse filesystem timestamps may not change on a quick rewrite
+        _REPOS_CACHE = None
     return True
 
+# Use libyaml's C parser when PyYAML was built with it
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_IGNORED_DIRS_CACHE = None  # (config_path, st_mtime_ns, frozenset of ignored directories)
+
+def _get_ignored_directories(config_path):
+    """
+    Returns the ignored directories from config.yaml, re-parsing the file only when its mtime changes.
+    Returns an empty set if the file does not exist.
+    """
+    global _IGNORED_DIRS_CACHE
+    try:
+        mtime = os.stat(config_path).st_mtime_ns
+    except FileNotFoundError:
+        return frozenset()
+    if _IGNORED_DIRS_CACHE and _IGNORED_DIRS_CACHE[:2] == (config_path, mtime):
+        return _IGNORED_DIRS_CACHE[2]
+
+    with open(config_path, "rb") as f:
+        config_data = yaml.load(f, Loader=_YAML_LOADER)
+    ignored_dirs = frozenset(config_data.get("ingestion", {}).get("ignored_directories", []))
+    _IGNORED_DIRS_CACHE = (config_path, mtime, ignored_dirs)
+    return ignored_dirs
+
+_LIST_FILES_MAX_CHARS = 50000
+
+def _walk_visible_files(target_dir, ignored_dirs):
+    """Yields file paths under target_dir, skipping hidden files and hidden or ignored directories."""
+    for root, dirs, files in os.walk(target_dir):
+        # Skip irrelevant directories (including those starting with '.')
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ignored_dirs]
+        
+        for file in files:
+            if not file.startswith('.'):
+                yield os.path.join(root, file)
+
 def list_files(directory_path=None):
     """
     Lists all files in the given directory, respecting ignored directories from config.yaml.
@@ -74,33 +148,29 @@ def list_files(directory_path=None):
         
         # Load ignored directories from config.yaml
         config_path = os.path.join(os.getcwd(), "config.yaml") # Assuming config.yaml is in the project root
-        all_ignored_dirs = set() # Initialize an empty set
-        if os.path.exists(config_path):
-            with open(config_path, "r") as f:
-                config_data = yaml.safe_load(f)
-            all_ignored_dirs = set(config_data.get("ingestion", {}).get("ignored_directories", []))
-        
-        for root, dirs, files in os.walk(target_dir):
-            # Skip irrelevant directories (including those starting with '.')
-            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in all_ignored_dirs]
-            
-            for file in files:
-                if not file.startswith('.'):
-                    files_list.append(os.path.join(root, file))
+        all_ignored_dirs = _get_ignored_directories(config_path)
         
-        # Serialize and truncate if massive
-        output = json.dumps(files_list)
-        if len(output) > 50000:
-            return f"Error: File list is too long ({len(output)} chars). Truncated. Found {len(files_list)} files. Please list a specific subdirectory."
+        # Track the serialized length as we go, so huge trees stop walking once over the limit
+        output_len = 0
+        for file_path in _walk_visible_files(target_dir, all_ignored_dirs):
+            files_list.append(file_path)
+            output_len += len(json.dumps(file_path)) + 2  # the ", " separator, or "[]" for the last entry
+            if output_len > _LIST_FILES_MAX_CHARS:
+                return f"Error: File list is too long (over {_LIST_FILES_MAX_CHARS} chars). Truncated. Stopped after {len(files_list)} files. Please list a specific subdirectory."
             
-        return output
+        return json.dumps(files_list)
     except Exception as e:
         return f"Error listing files: {e}"
 
-def read_file(file_path):
+# Tool output goes into the model's context, so reads are capped
+_READ_FILE_MAX_BYTES = 200_000
+_BINARY_SNIFF_BYTES = 512
+
+def read_file(file_path, max_bytes=None):
     """
     Reads the content of a specific file. 
     Resolves relative paths against the active workspace.
+    Returns at most max_bytes (capped at 200 KB) with a truncation marker, and refuses binary files.
     """
     try:
         # Resolve path against workspace if it's relative
@@ -116,12 +186,101 @@ def read_file(file_path):
         if not os.path.exists(full_path):
             return f"Error: File '{full_path}' does not exist."
 
-        with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
+        limit = _READ_FILE_MAX_BYTES if max_bytes is None else max(1, min(int(max_bytes), _READ_FILE_MAX_BYTES))
+        size = os.path.getsize(full_path)
+        with open(full_path, 'rb') as f:
+            data = f.read(limit)
+
+        # NUL bytes near the start mean a binary file, which is useless to the model
+        if b"\0" in data[:_BINARY_SNIFF_BYTES]:
+            return f"Error: File '{full_path}' appears to be binary and was not read."
+
+        # Decode and normalize newlines the way text mode would
+        content = data.decode('utf-8', errors='ignore').replace('\r\n', '\n').replace('\r', '\n')
+        if size > limit:
+            content += f"\n\n[... truncated {size - limit} bytes ...]"
         return content
     except Exception as e:
         return f"Error reading file: {e}"
 
+def get_graph_index_path(repo_path):
+    """Returns the path of the SQLite FTS5 search index kept alongside the knowledge graph JSON."""
+    graph_path = get_graph_path(repo_path)
+    if not graph_path:
+        return None
+    return os.path.splitext(graph_path)[0] + ".sqlite"
+
+def write_graph_index(index_path, knowledge_graph):
+    """
+    Writes the knowledge graph into SQLite FTS5 tables using the trigram tokenizer,
+    so search_knowledge_graph's case-insensitive substring matches are served by an index.
+    The index is built in a temporary file and swapped in, so concurrent searches never see a partial index.
+    """
+    tmp_path = f"{index_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    with closing(sqlite3.connect(tmp_path)) as conn:
+        with conn:
+            conn.execute("CREATE VIRTUAL TABLE graph_nodes USING fts5(id, file, type UNINDEXED, tokenize='trigram')")
+            conn.execute("CREATE VIRTUAL TABLE graph_edges USING fts5(source, target, type UNINDEXED, tokenize='trigram')")
+            conn.executemany(
+                "INSERT INTO graph_nodes (id, file, type) VALUES (?, ?, ?)",
+                ((n.get("id", ""), n.get("file", ""), n.get("type", "")) for n in knowledge_graph["nodes"])
+            )
+            conn.executemany(
+                "INSERT INTO graph_edges (source, target, type) VALUES (?, ?, ?)",
+                ((e.get("source", ""), e.get("target", ""), e.get("type", "")) for e in knowledge_graph["edges"])
+            )
+            conn.execute("INSERT INTO graph_nodes (graph_nodes) VALUES ('optimize')")
+            conn.execute("INSERT INTO graph_edges (graph_edges) VALUES ('optimize')")
+    os.replace(tmp_path, index_path)
+
+def _search_graph_index(index_path, query):
+    """Searches the FTS5 graph index. Returns results in the same shape and order as the JSON scan."""
+    # Escaped so '?', '#' or '%' in the path can't alter the URI
+    uri = "file:" + pathname2url(os.path.abspath(index_path)) + "?mode=ro"
+    with closing(sqlite3.connect(uri, uri=True)) as conn:
+        if len(query) >= 3:
+            # Trigram phrase queries are case-insensitive substring matches
+            phrase = '"' + query.replace('"', '""') + '"'
+            nodes = conn.execute(
+                "SELECT id, type, file FROM graph_nodes WHERE graph_nodes MATCH ? ORDER BY rowid",
+                (f"{{id file}} : {phrase}",)
+            ).fetchall()
+            edges = conn.execute(
+                "SELECT source, target, type FROM graph_edges WHERE graph_edges MATCH ? ORDER BY rowid",
+                (f"{{source target}} : {phrase}",)
+            ).fetchall()
+        else:
+            # Trigrams need at least 3 characters; shorter queries scan the tables instead
+            query_lower = query.lower()
+            nodes = conn.execute(
+                "SELECT id, type, file FROM graph_nodes WHERE instr(lower(id), ?) OR instr(lower(file), ?) ORDER BY rowid",
+                (query_lower, query_lower)
+            ).fetchall()
+            edges = conn.execute(
+                "SELECT source, target, type FROM graph_edges WHERE instr(lower(source), ?) OR instr(lower(target), ?) ORDER BY rowid",
+                (query_lower, query_lower)
+            ).fetchall()
+    return {
+        "nodes": [{"id": i, "type": t, "file": f} for i, t, f in nodes],
+        "edges": [{"source": s, "target": t, "type": k} for s, t, k in edges],
+    }
+
+@lru_cache(maxsize=4)
+def _load_searchable_graph(graph_path, mtime_ns):
+    """
+    Loads a JSON graph for the fallback scan along with its lowercased search keys, keyed by mtime
+    so repeated queries skip the parse and the per-node lower() calls until the graph is rebuilt.
+    """
+    with open(graph_path, 'rb') as f:
+        graph = json_loads(f.read())
+    nodes = graph.get("nodes", [])
+    edges = graph.get("edges", [])
+    node_keys = [(node.get("id", "").lower(), node.get("file", "").lower()) for node in nodes]
+    edge_keys = [(edge.get("source", "").lower(), edge.get("target", "").lower()) for edge in edges]
+    return nodes, node_keys, edges, edge_keys
+
 def search_knowledge_graph(query, repo_path=None):
     """
     Searches the centralized knowledge graph for nodes or edges matching the query.
@@ -136,29 +295,36 @@ def search_knowledge_graph(query, repo_path=None):
         if not graph_path or not os.path.exists(graph_path):
              return f"Error: Knowledge graph not found for '{target_path}'. Please build it first on the Ingest page."
 
-        with open(graph_path, 'r', encoding='utf-8') as f:
-            graph = json.load(f)
-        
-        results = {"nodes": [], "edges": []}
-        query_lower = query.lower()
+        # Use the FTS5 index when it is at least as fresh as the JSON graph
+        index_path = get_graph_index_path(target_path)
+        if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(graph_path):
+            try:
+                return json_dumps(_search_graph_index(index_path, query), pretty=True)
+            except sqlite3.Error as e:
+                # A locked or damaged index shouldn't fail the search; the JSON scan returns the same results
+                print(f"Graph search index unavailable, scanning the graph instead: {e}")
 
-        for node in graph.get("nodes", []):
-            if query_lower in node.get("id", "").lower() or query_lower in node.get("file", "").lower():
-                results["nodes"].append(node)
-        
-        for edge in graph.get("edges", []):
-            if query_lower in edge.get("source", "").lower() or query_lower in edge.get("target", "").lower():
-                results["edges"].append(edge)
+        nodes, node_keys, edges, edge_keys = _load_searchable_graph(graph_path, os.stat(graph_path).st_mtime_ns)
+        query_lower = query.lower()
+        results = {
+            "nodes": [node for node, (id_lc, file_lc) in zip(nodes, node_keys) if query_lower in id_lc or query_lower in file_lc],
+            "edges": [edge for edge, (source_lc, target_lc) in zip(edges, edge_keys) if query_lower in source_lc or query_lower in target_lc],
+        }
                 
-        return json.dumps(results, indent=2)
+        return json_dumps(results, pretty=True)
 
     except Exception as e:
         return f"Error searching knowledge graph: {e}"
 
+@lru_cache(maxsize=None)
 def get_tool_definitions():
     """
     Returns the function declarations for the Gemini API.
+    The declarations are static, so they are built once and shared.
     """
+    # Deferred so the file, repository and graph helpers can be used without loading the SDK
+    from google.genai import types
+
     return [
         types.FunctionDeclaration(
             name="set_workspace_path",
@@ -189,13 +355,17 @@ def get_tool_definitions():
         ),
         types.FunctionDeclaration(
             name="read_file",
-            description="Reads the content of a specific file.",
+            description="Reads the content of a specific text file. Files over 200 KB are truncated and binary files are refused.",
             parameters=types.Schema(
                 type="OBJECT",
                 properties={
                     "file_path": types.Schema(
                         type="STRING",
                         description="The path of the file to read (relative to workspace or absolute)."
+                    ),
+                    "max_bytes": types.Schema(
+                        type="INTEGER",
+                        description="Optional maximum number of bytes to read (default and maximum 200000). Longer files are truncated."
                     )
                 },
                 required=["file_path"]
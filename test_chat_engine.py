@@ -0,0 +1,33 @@
+from core.chat_engine import init_db, add_chat_history, flush_chat_history, load_conversation_from_db, close_connections
+import os
+import tempfile
+import threading
+
+def test_writer_isolates_rejected_row():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_name = os.path.join(tmp_dir, "history.db")
+        init_db(db_name)
+
+        # A lone surrogate can't be encoded to UTF-8, so the insert raises UnicodeEncodeError
+        add_chat_history(db_name, "bad", "hello \ud800", "resp")
+        flusher = threading.Thread(target=flush_chat_history, daemon=True)
+        flusher.start()
+        flusher.join(timeout=5)
+        assert not flusher.is_alive(), "flush_chat_history() hung after a rejected row"
+
+        add_chat_history(db_name, "good", "hello", "resp")
+        assert load_conversation_from_db(db_name, "good") == [("hello", "resp", None)]
+
+        # Good rows queued in the same batch as a rejected one are still written
+        add_chat_history(db_name, "before", "first", "resp")
+        add_chat_history(db_name, "bad", "again \ud800", "resp")
+        add_chat_history(db_name, "after", "second", "resp")
+        flush_chat_history()
+        assert load_conversation_from_db(db_name, "before") == [("first", "resp", None)]
+        assert load_conversation_from_db(db_name, "after") == [("second", "resp", None)]
+        assert load_conversation_from_db(db_name, "bad") == []
+        close_connections()
+
+if __name__ == "__main__":
+    test_writer_isolates_rejected_row()
+    print("[PASS] background writer dropped only the rejected row")
@@ -1,12 +1,11 @@
 from core.tools import list_files, read_file, search_knowledge_graph, get_graph_path
-import json
 import os
 
 def test_tools():
     print("Testing list_files...")
     files_json = list_files(".")
-    files = json.loads(files_json) if not files_json.startswith("Error") else []
-    if "app.py" in str(files):
+    # A substring check on the JSON text is enough; no need to parse the listing
+    if not files_json.startswith("Error") and "app.py" in files_json:
         print("[PASS] list_files passed")
     else:
         print(f"[FAIL] list_files failed: {files_json}")
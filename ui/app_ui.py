@@ -1,15 +1,14 @@
 import gradio as gr
-from ui.ingest_tab import create_ingest_ui
-from ui.chat_tab import create_chat_ui
-
-from core.tools import get_tool_definitions, list_files, read_file, search_knowledge_graph, set_workspace_path, get_repositories
+from core.tools import get_repositories
 
 def create_ui(client, prompts, config):
     """
     Creates the main Gradio Blocks interface by combining tabs.
     """
-    store = None # Deprecated global store concept
-    
+    # Imported here so importing this module doesn't pull in every tab's dependencies
+    from ui.ingest_tab import create_ingest_ui
+    from ui.chat_tab import create_chat_ui
+
     css = """
     .conversation-list-container {
         max-height: 300px;
@@ -30,12 +29,13 @@ def create_ui(client, prompts, config):
         gr.Markdown("<h1 style='text-align: center;'>Aurora Codex</h1>")
 
 
+        # Both tabs start from the same repository list
+        repos = get_repositories()
+
         # Create the Ingest tab
-        create_ingest_ui(client, store, config)
+        create_ingest_ui(client, config, repos=repos)
 
         # Create the Chat tab
-        create_chat_ui(client, store, prompts, config)
-        
-    return demo
+        create_chat_ui(client, prompts, config, repos=repos)
         
     return demo
@@ -1,17 +1,26 @@
 import gradio as gr
-from gradio.components import ChatMessage
 import json
+import re
+import threading
+import time
+from collections import OrderedDict
 from core.chat_engine import (
     chat_fn, load_conversation_from_db, delete_conversation_from_db, 
     generate_report, generate_visualization, get_conversations,
-    init_db
+    init_db, json_loads, format_tool_status_detail
 )
-from core.tools import get_tool_definitions, list_files, read_file, search_knowledge_graph, set_workspace_path, get_repositories
+from core.tools import set_workspace_path, get_repositories
 
 # Local UI Helper Functions
 
+# First `backticked` span of a status message, e.g. the tool name in "🛠️ `read_file` → ..."
+_BACKTICK_RE = re.compile(r"`([^`]*)`")
+
 def _get_conversation_controls_updates(visible: bool, report_file_value=None):
-    """Helper to generate gr.update dictionaries for conversation-specific controls."""
+    """
+    Helper to generate gr.update dictionaries for conversation-specific controls.
+    Fresh dicts are built on every call because Gradio pops keys (e.g. "value") from update dicts as it applies them.
+    """
     return (
         gr.update(visible=visible),  # delete_conversation_button
         gr.update(visible=visible),  # generate_report_button
@@ -23,7 +32,7 @@ def _get_conversation_controls_updates(visible: bool, report_file_value=None):
 def get_formatted_conversations(db_name, repo_path=None):
     """Fetches and formats conversations for the gr.Radio component."""
     convos = get_conversations(db_name, repo_path)
-    return [(f"{title[:40]}..." if len(title) > 40 else title, conv_id) for conv_id, title in convos]
+    return [(title, conv_id) for conv_id, title in convos]
 
 def refresh_conversation_list(db_name, repo_path=None):
     """Refreshes the list of conversations in the sidebar."""
@@ -37,76 +46,117 @@ def start_new_chat(db_name, repo_path=None):
     visualization_clear = "No visualization generated yet. Ask a question and then click 'Visualize Impact'."
     return None, None, None, conversation_list_update, visualization_clear, *_get_conversation_controls_updates(False)
 
-def load_conversation(conversation_id, db_name):
-    """Loads a past conversation from the database into the chat window."""
+def _format_interaction(query, response, tool_calls_json):
+    """Returns the user and assistant message dicts for one stored interaction."""
+    tool_calls = []
+    if tool_calls_json:
+        try:
+            tool_calls = json_loads(tool_calls_json)
+        except (json.JSONDecodeError, TypeError):
+            pass
+
+    # Re-create the visual tool call history as seen during live generation
+    status_lines = []
+    for tool_call in tool_calls:
+        func_name = tool_call.get("name", "tool")
+        status_detail = format_tool_status_detail(func_name, tool_call.get('args', {}))
+        status_lines.append(f"✅ `{func_name}`{status_detail} ✓\n")
+
+    assistant_message = {"role": "assistant", "content": "".join(status_lines) + (response or "")}
+    if tool_calls:
+        # Add tool calls to metadata. The UI won't show it unless we tell it to.
+        assistant_message["metadata"] = {"tool_calls": tool_calls}
+    return {"role": "user", "content": query}, assistant_message
+
+# Interactions formatted per update when streaming a long conversation into the chat window
+_LOAD_BATCH_SIZE = 32
+
+# --- Loaded Conversation Cache ---
+# (db_name, conversation_id, limit) -> formatted chat history, so reopening a conversation skips
+# the query and the tool-call parsing. Entries are dropped when the conversation gets a new turn or is deleted.
+_LOADED_CACHE_SIZE = 16
+_loaded_conversations = OrderedDict()
+_loaded_generation = 0  # bumped on invalidation, so in-flight loads don't store stale history
+_loaded_conversations_lock = threading.Lock()
+
+def _forget_loaded_conversation(db_name, conversation_id):
+    """Drops the cached history of a conversation, for every load limit."""
+    global _loaded_generation
+    with _loaded_conversations_lock:
+        _loaded_generation += 1
+        for key in [key for key in _loaded_conversations if key[:2] == (db_name, conversation_id)]:
+            del _loaded_conversations[key]
+
+def load_conversation(conversation_id, db_name, limit=None):
+    """
+    Loads a past conversation from the database into the chat window.
+    Long conversations are yielded in batches, so the first messages render while the rest are formatted.
+    """
     if not conversation_id:
-        return [], None, None, gr.update(value=None), *_get_conversation_controls_updates(False)
+        yield [], None, None, gr.update(value=None), *_get_conversation_controls_updates(False)
+        return
+
+    key = (db_name, conversation_id, limit)
+    with _loaded_conversations_lock:
+        cached = _loaded_conversations.get(key)
+        if cached is not None:
+            _loaded_conversations.move_to_end(key)
+        generation = _loaded_generation
+    if cached is not None:
+        yield list(cached), None, conversation_id, gr.update(value=conversation_id), *_get_conversation_controls_updates(True)
+        return
 
     print(f"Loading conversation: {conversation_id}")
-    history = load_conversation_from_db(db_name, conversation_id)
+    history = load_conversation_from_db(db_name, conversation_id, limit)
 
     if not history:
-        return [], None, None, gr.update(value=conversation_id), *_get_conversation_controls_updates(True)
+        yield [], None, None, gr.update(value=conversation_id), *_get_conversation_controls_updates(True)
+        return
 
     chat_history_formatted = []
-    for query, response, tool_calls_json in history:
-        chat_history_formatted.append(ChatMessage(role="user", content=query))
-        
-        tool_calls = []
-        if tool_calls_json:
-            try:
-                tool_calls = json.loads(tool_calls_json)
-            except (json.JSONDecodeError, TypeError):
-                pass
-        
-        display_content = response if response else ""
-        
-        # Add tool calls to metadata. The UI won't show it unless we tell it to.
-        metadata = {"tool_calls": tool_calls} if tool_calls else None
-
-        # Re-create the visual tool call history as seen during live generation
-        full_response_content = ""
-        if tool_calls:
-            for tool_call in tool_calls:
-                func_name = tool_call.get("name", "tool")
-                args = tool_call.get('args', {})
-                arg_desc = ""
-                if func_name == "read_file":
-                    arg_desc = f"`{args.get('file_path', '?')}`"
-                elif func_name == "search_knowledge_graph":
-                    arg_desc = f"query: `{args.get('query', '?')}`"
-                elif func_name == "list_files":
-                    arg_desc = f"`{args.get('directory_path', 'workspace')}`"
-                
-                status_detail = f" → {arg_desc}" if arg_desc else ""
-                full_response_content += f"✅ `{func_name}`{status_detail} ✓\n"
-        
-        full_response_content += display_content
-
-        chat_history_formatted.append(ChatMessage(role="assistant", content=full_response_content, metadata=metadata))
+    for start in range(0, len(history), _LOAD_BATCH_SIZE):
+        chat_history_formatted.extend(
+            message
+            for query, response, tool_calls_json in history[start:start + _LOAD_BATCH_SIZE]
+            for message in _format_interaction(query, response, tool_calls_json)
+        )
+        # Yield a copy, since the list keeps growing after Gradio receives it
+        yield list(chat_history_formatted), None, conversation_id, gr.update(value=conversation_id), *_get_conversation_controls_updates(True)
 
-    return chat_history_formatted, None, conversation_id, gr.update(value=conversation_id), *_get_conversation_controls_updates(True)
+    with _loaded_conversations_lock:
+        if generation == _loaded_generation:
+            _loaded_conversations[key] = chat_history_formatted
+            while len(_loaded_conversations) > _LOADED_CACHE_SIZE:
+                _loaded_conversations.popitem(last=False)
 
 def delete_conversation(conversation_id, db_name, refresh_conversation_list_fn, repo_path=None):
     """Deletes a conversation and updates the UI."""
     if not conversation_id:
         return None, None, None, gr.update(), *_get_conversation_controls_updates(False)
 
-    success = delete_conversation_from_db(db_name, conversation_id)
+    deleted = delete_conversation_from_db(db_name, conversation_id)
+    _forget_loaded_conversation(db_name, conversation_id)
 
-    if not success:
+    if deleted is None:
         return gr.update(), gr.update(), gr.update(), gr.update(), *_get_conversation_controls_updates(True)
 
+    if deleted == 0:
+        # Nothing was stored for this conversation, so the sidebar list is already current
+        return None, None, None, gr.update(value=None), *_get_conversation_controls_updates(False)
+
     conversation_list_update, *control_updates = refresh_conversation_list_fn(repo_path)
     return None, None, None, conversation_list_update, *control_updates
 
+# Minimum seconds between chat window updates while a response streams in
+_STREAM_YIELD_INTERVAL = 0.05
+
 def chat_wrapper(message, history, assess_criticality, chat_session, conversation_id_state, repo_path, client, prompts, config, refresh_conversation_list_fn):
     """
     Wrapper function to manage history for the custom chat UI.
     It calls the main chat_fn and handles history updates.
     """
-    history.append(ChatMessage(role="user", content=message))
-    history.append(ChatMessage(role="assistant", content="🧠 *Thinking...*"))
+    history.append({"role": "user", "content": message})
+    history.append({"role": "assistant", "content": "🧠 *Thinking...*"})
     
     yield history, "", chat_session, conversation_id_state, gr.update()
 
@@ -123,6 +173,7 @@ def chat_wrapper(message, history, assess_criticality, chat_session, conversatio
     new_conversation_id = conversation_id_state
     new_chat_session = chat_session
     pending_tool_msg = None  # Track pending "executing" message to update with result
+    last_yield = time.monotonic()
     
     for response_text, updated_session, updated_conv_id, new_convo_flag in chat_gen:
         new_chat_session = updated_session
@@ -132,62 +183,70 @@ def chat_wrapper(message, history, assess_criticality, chat_session, conversatio
         # Check if this is a status update vs final response
         if response_text and response_text[0] in "🛠️✅❌🧠⚠️":
             # Extract tool name from content if present
-            tool_name = response_text.split("`")[1] if "`" in response_text else "tool"
+            tool_match = _BACKTICK_RE.search(response_text)
+            tool_name = tool_match.group(1) if tool_match else "tool"
             
             if response_text.startswith("🛠️"):
                 # Starting a tool - replace placeholder with executing message
-                history[-1] = ChatMessage(
-                    role="assistant",
-                    content=response_text,
-                    metadata={"title": f"🔄 Using {tool_name}..."}
-                )
+                history[-1] = {
+                    "role": "assistant",
+                    "content": response_text,
+                    "metadata": {"title": f"🔄 Using {tool_name}..."}
+                }
                 pending_tool_msg = len(history) - 1
             elif response_text.startswith("✅"):
                 # Tool completed - update the pending message with completion
                 if pending_tool_msg is not None and pending_tool_msg < len(history):
-                    history[pending_tool_msg] = ChatMessage(
-                        role="assistant",
-                        content=response_text,
-                        metadata={"title": f"✅ {tool_name}"}
-                    )
+                    history[pending_tool_msg] = {
+                        "role": "assistant",
+                        "content": response_text,
+                        "metadata": {"title": f"✅ {tool_name}"}
+                    }
                 pending_tool_msg = None
                 # Add placeholder for next action (will be replaced)
-                history.append(ChatMessage(role="assistant", content="🧠 *Analyzing...*"))
+                history.append({"role": "assistant", "content": "🧠 *Analyzing...*"})
             elif response_text.startswith("❌"):
                 # Tool error - update with error
                 if pending_tool_msg is not None and pending_tool_msg < len(history):
-                    history[pending_tool_msg] = ChatMessage(
-                        role="assistant",
-                        content=response_text,
-                        metadata={"title": f"💥 {tool_name} error"}
-                    )
+                    history[pending_tool_msg] = {
+                        "role": "assistant",
+                        "content": response_text,
+                        "metadata": {"title": f"💥 {tool_name} error"}
+                    }
                 pending_tool_msg = None
-                history.append(ChatMessage(role="assistant", content="🧠 *Continuing...*"))
+                history.append({"role": "assistant", "content": "🧠 *Continuing...*"})
             elif response_text.startswith("🧠"):
                 # Processing - update last message
-                history[-1].content = response_text
+                history[-1]["content"] = response_text
             elif response_text.startswith("⚠️"): # Handle warning/error messages
-                history[-1].content = response_text
+                history[-1]["content"] = response_text
         else:
             # Final response - replace placeholder with actual content
-            history[-1] = ChatMessage(role="assistant", content=response_text)
+            history[-1] = {"role": "assistant", "content": response_text}
             final_response_text = response_text
+            # Coalesce streamed text into at most one update per interval; the last one is sent after the loop
+            if time.monotonic() - last_yield < _STREAM_YIELD_INTERVAL:
+                continue
         
+        last_yield = time.monotonic()
         yield history, "", new_chat_session, new_conversation_id, gr.update()
     
+    # The turn was added to this conversation's stored history
+    if new_conversation_id:
+        _forget_loaded_conversation(config["database_name"], new_conversation_id)
     conversation_list_update = refresh_conversation_list_fn(repo_path) if new_convo_started else gr.update()
     yield history, "", new_chat_session, new_conversation_id, conversation_list_update
 
 
 
-def create_chat_ui(client, _, prompts, config): # store passed is ignored
-    """Creates the Gradio UI for the Chat tab."""
+def create_chat_ui(client, prompts, config, repos=None):
+    """Creates the Gradio UI for the Chat tab. repos is the repository list, fetched if not given."""
     db_name = config["database_name"]
 
     with gr.Tab("Chat") as chat_tab:
         with gr.Row():
             with gr.Sidebar(open=False):
-                current_repos = get_repositories()
+                current_repos = get_repositories() if repos is None else repos
                 initial_repo = current_repos[0] if current_repos else None
                 
                 repo_dropdown = gr.Dropdown(
@@ -240,16 +299,23 @@ def create_chat_ui(client, _, prompts, config): # store passed is ignored
 
         # --- Event Handlers ---
         refresh_fn = lambda repo: refresh_conversation_list(db_name, repo)
-        load_conversation_fn = lambda conv_id: load_conversation(conv_id, db_name)
+        history_load_limit = config.get("chat_history", {}).get("load_limit")
+        def load_conversation_fn(conv_id):
+            yield from load_conversation(conv_id, db_name, history_load_limit)
         conversation_controls = [delete_conversation_button, generate_report_button, report_file, visualize_button, visualize_neighbors_checkbox]
         
+        # One handler, so a repository switch is a single round-trip
+        def repo_change_fn(repo):
+            set_workspace_path(repo)
+            return (
+                *refresh_fn(repo),
+                None, None, None, "No visualization generated yet. Ask a question and then click 'Visualize Impact'."
+            )
+
         repo_dropdown.change(
-             fn=lambda repo: (set_workspace_path(repo), None)[1], inputs=[repo_dropdown], outputs=[]
-        ).then(
-             fn=refresh_fn, inputs=[repo_dropdown], outputs=[conversation_list] + conversation_controls
-        ).then(
-             fn=lambda: (None, None, None, "No visualization generated yet. Ask a question and then click 'Visualize Impact'."), 
-             outputs=[chatbot, chat_session_state, conversation_id_state, visualization_output]
+             fn=repo_change_fn,
+             inputs=[repo_dropdown],
+             outputs=[conversation_list] + conversation_controls + [chatbot, chat_session_state, conversation_id_state, visualization_output]
         )
 
         def chat_wrapper_fn(msg, hist, crit, sess, conv_id, repo):
@@ -266,7 +332,9 @@ def create_chat_ui(client, _, prompts, config): # store passed is ignored
                 conversation_id_state,
                 repo_dropdown
             ],
-            outputs=[chatbot, chat_input_multimodal, chat_session_state, conversation_id_state, conversation_list]
+            outputs=[chatbot, chat_input_multimodal, chat_session_state, conversation_id_state, conversation_list],
+            concurrency_limit=config.get("queue", {}).get("gemini_concurrency_limit", 20),
+            concurrency_id="gemini"
         )
 
         chatbot.example_select(fn=populate_example, inputs=None, outputs=[chat_input_multimodal])
@@ -303,4 +371,4 @@ def create_chat_ui(client, _, prompts, config): # store passed is ignored
         generate_report_button.click(fn=generate_report_ui, inputs=[conversation_id_state], outputs=[report_file])
 
         visualize_fn = lambda conv_id, repo, show_neighbors: generate_visualization(conv_id, db_name, config, repo, show_neighbors)
-        visualize_button.click(fn=visualize_fn, inputs=[conversation_id_state, repo_dropdown, visualize_neighbors_checkbox], outputs=[visualization_output], show_progress="hidden")
\ No newline at end of file
+        visualize_button.click(fn=visualize_fn, inputs=[conversation_id_state, repo_dropdown, visualize_neighbors_checkbox], outputs=[visualization_output], show_progress="hidden", concurrency_id="graph")
\ No newline at end of file
@@ -2,12 +2,12 @@ import gradio as gr
 from core.ingest import ingest_files, build_knowledge_graph, view_knowledge_graph
 from core.tools import add_repository, get_repositories
 
-def create_ingest_ui(client, store, config):
-    """Creates the Gradio UI for the Ingest Codebase tab."""
+def create_ingest_ui(client, config, repos=None):
+    """Creates the Gradio UI for the Ingest Codebase tab. repos is the repository list, fetched if not given."""
     with gr.Tab("Ingest Codebase"):
         with gr.Row():
             with gr.Sidebar(open=False):
-                current_repos = get_repositories()
+                current_repos = get_repositories() if repos is None else repos
                 initial_repo = current_repos[0] if current_repos else None
                 
                 ingest_repo_dropdown = gr.Dropdown(
@@ -37,15 +37,25 @@ def create_ingest_ui(client, store, config):
                 ingest_status = gr.Textbox(label="Status", interactive=False, lines=4, show_copy_button=True)
                 graph_view = gr.Code(language="json", label="Knowledge Graph", visible=False, lines=20)
 
+        def ingest_handler(path, cfg):
+            add_repository(path)
+            yield from ingest_files(path, client, cfg)
+
+        def build_graph_handler(path):
+            add_repository(path)
+            yield from build_knowledge_graph(path, config)
+
         ingest_button.click(
-            fn=lambda path, cfg: (add_repository(path), (yield from ingest_files(path, client, None, cfg)))[1], 
+            fn=ingest_handler,
             inputs=[local_repo_path, gr.State(config)],
             outputs=[ingest_status],
-            show_progress="hidden"
+            show_progress="hidden",
+            concurrency_limit=config.get("queue", {}).get("gemini_concurrency_limit", 20),
+            concurrency_id="gemini"
         )
 
         build_graph_button.click(
-            fn=lambda path: (add_repository(path), (yield from build_knowledge_graph(path, config)))[1],
+            fn=build_graph_handler,
             inputs=[local_repo_path],
             outputs=[ingest_status]
         )